@@ -1,8 +1,16 @@
+import asyncio
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import ChatRoom, Message
+from django.db import transaction
+from .models import ChatRoom, Message, UnreadCounter
+from .writer import message_writer
+from posts.models import Notification
+
+# Seconds to wait before recounting, so a burst of updates costs one query
+UNREAD_COALESCE_DELAY = 0.25
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -20,68 +28,105 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.room_group_name = f'chat_{self.room_id}'
         self.user = user
 
-        room = await self.get_room()
-        if not room:
+        # Room, peer and mutual-follow status in one (cached) lookup
+        self.room_context = await self.get_room_context(user)
+        if not self.room_context:
             await self.close(code=4404)
             return
 
-        if not await self.is_member(room, user):
+        if not self.room_context['is_friend']:
             await self.close(code=4403)
             return
+        self.peer_id = self.room_context['peer_id']
 
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
-        
-        # Join user's personal notification group
-        self.user_group_name = f'user_{user.id}_notifications'
-        await self.channel_layer.group_add(
-            self.user_group_name,
-            self.channel_name
-        )
+        # Unread counts reach the user through NotificationConsumer, so the
+        # chat socket only needs the room group
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         
         await self.accept()
         
-        # Mark messages as read when user connects
+        # Mark messages as read when user connects and push the new counts
         await self.mark_messages_read(user)
-        
-        # Notify other user to update their unread count
-        other_user = await self.get_other_user(room, user)
-        if other_user:
-            await self.channel_layer.group_send(
-                f'user_{other_user.id}_notifications',
-                {
-                    'type': 'unread_update',
-                    'action': 'refresh'
-                }
-            )
+        await self.notify_unread(user.id)
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
-        if hasattr(self, 'user_group_name'):
-            await self.channel_layer.group_discard(
-                self.user_group_name,
-                self.channel_name
-            )
+        # Make sure everything this socket sent is on disk before it goes
+        self.room_context = None
+        if getattr(self, 'pending_writes', None):
+            await asyncio.gather(*self.pending_writes, return_exceptions=True)
+
+        if hasattr(self, 'room_group_name'):
+            await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
     async def receive(self, text_data):
+        if not getattr(self, 'room_context', None):
+            return
+
         try:
             data = json.loads(text_data)
         except json.JSONDecodeError:
             return
 
+        if data.get('action') == 'load_older':
+            await self.send_history(data.get('before'))
+            return
+
         message_text = (data.get('message') or '').strip()
         if not message_text:
             return
 
         user = self.scope["user"]
+        if settings.CHAT_WRITE_BEHIND:
+            await self.queue_message(user, message_text, data.get('client_id'))
+            return
+
         msg = await self.save_message(user, message_text)
+        await asyncio.gather(
+            self.broadcast_message(user, msg),
+            self.notify_unread(self.peer_id),
+        )
+
+    async def queue_message(self, user, text, client_id):
+        """Broadcast now and let the write-behind buffer persist the message.
+
+        Blocks while the buffer is full. The sender gets a ``message_saved``
+        (or ``message_failed``) acknowledgement once the batch is written,
+        and the peer's unread count is only bumped after that. The timestamp
+        is set when the row is inserted, so the broadcast carries none and
+        the acknowledgement carries the stored one.
+        """
+        msg = Message(room_id=self.room_id, sender_id=user.id, text=text, is_read=False)
+        saved = await message_writer.enqueue(msg, self.peer_id)
+        if not hasattr(self, 'pending_writes'):
+            self.pending_writes = set()
+        self.pending_writes.add(saved)
+        saved.add_done_callback(self.pending_writes.discard)
+
+        await self.broadcast_message(user, msg, client_id)
+        asyncio.ensure_future(self.acknowledge(saved, client_id))
+
+    async def acknowledge(self, saved, client_id):
+        try:
+            msg = await saved
+        except Exception:
+            if self.room_context:
+                await self.send(text_data=json.dumps({
+                    'type': 'message_failed',
+                    'client_id': client_id
+                }))
+            return
 
-        # Send message to room group
+        await self.notify_unread(self.peer_id)
+        if self.room_context:
+            await self.send(text_data=json.dumps({
+                'type': 'message_saved',
+                'client_id': client_id,
+                'id': msg.id,
+                'timestamp': msg.timestamp.isoformat(),
+                'cursor': msg.cursor
+            }))
+
+    async def broadcast_message(self, user, msg, client_id=None):
         await self.channel_layer.group_send(
             self.room_group_name,
             {
@@ -89,21 +134,37 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'message': msg.text,
                 'sender': user.username,
                 'sender_name': user.get_full_name() or user.username,
-                'timestamp': msg.timestamp.isoformat()
+                # Unset until a write-behind message is stored
+                'timestamp': msg.timestamp.isoformat() if msg.timestamp else None,
+                'client_id': client_id
             }
         )
-        
-        # Notify other user to update unread count
-        room = await self.get_room()
-        other_user = await self.get_other_user(room, user)
-        if other_user:
-            await self.channel_layer.group_send(
-                f'user_{other_user.id}_notifications',
+
+    async def notify_unread(self, user_id):
+        """Tell a user's notification sockets to push fresh unread counts"""
+        await self.channel_layer.group_send(
+            f'user_{user_id}_notifications',
+            {'type': 'unread_update'}
+        )
+
+    async def send_history(self, before):
+        """Stream the page of messages preceding the ``before`` cursor"""
+        messages, has_more = await self.get_history(before)
+        await self.send(text_data=json.dumps({
+            'type': 'history',
+            'messages': [
                 {
-                    'type': 'unread_update',
-                    'action': 'increment'
+                    'id': msg.id,
+                    'message': msg.text,
+                    'sender': msg.sender.username,
+                    'sender_name': msg.sender.get_full_name() or msg.sender.username,
+                    'timestamp': msg.timestamp.isoformat()
                 }
-            )
+                for msg in messages
+            ],
+            'has_more': has_more,
+            'cursor': messages[0].cursor if messages else None
+        }))
 
     async def chat_message(self, event):
         await self.send(text_data=json.dumps({
@@ -111,75 +172,108 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'message': event['message'],
             'sender': event['sender'],
             'sender_name': event['sender_name'],
-            'timestamp': event['timestamp']
+            'timestamp': event['timestamp'],
+            'client_id': event.get('client_id')
         }))
 
-    async def unread_update(self, event):
-        """Handle unread count updates"""
-        await self.send(text_data=json.dumps({
-            'type': 'unread_update',
-            'action': event['action']
-        }))
+    async def room_context_invalidated(self, event):
+        """Friendship ended; drop the cached context and close the socket"""
+        self.room_context = None
+        await self.close(code=4403)
 
     @database_sync_to_async
-    def get_room(self):
-        try:
-            return ChatRoom.objects.get(id=self.room_id)
-        except ChatRoom.DoesNotExist:
-            return None
+    def get_room_context(self, user):
+        return ChatRoom.load_context(self.room_id, user)
 
     @database_sync_to_async
-    def is_member(self, room, user):
-        users = list(room.users.all())
-        if len(users) != 2:
-            return False
-        other = users[0] if users[1] == user else users[1]
-        return (user.profile.is_following(other) and 
-                other.profile.is_following(user))
+    def get_history(self, before):
+        return Message.history(self.room_id, before=before)
 
     @database_sync_to_async
     def save_message(self, sender, text):
-        room = ChatRoom.objects.get(id=self.room_id)
-        return Message.objects.create(room=room, sender=sender, text=text, is_read=False)
+        # Insert by foreign key ids only; no need to load the room
+        with transaction.atomic():
+            msg = Message.objects.create(room_id=self.room_id, sender_id=sender.id, text=text, is_read=False)
+            UnreadCounter.increment(self.room_id, self.peer_id)
+        return msg
     
     @database_sync_to_async
     def mark_messages_read(self, user):
         """Mark all messages in this room as read for the user"""
-        room = ChatRoom.objects.get(id=self.room_id)
-        room.messages.filter(is_read=False).exclude(sender=user).update(is_read=True)
-    
-    @database_sync_to_async
-    def get_other_user(self, room, current_user):
-        """Get the other user in the chat room"""
-        users = room.users.exclude(id=current_user.id)
-        return users.first() if users.exists() else None
+        ChatRoom.mark_read(self.room_id, user.id)
 
 
 class NotificationConsumer(AsyncWebsocketConsumer):
-    """Consumer for global notifications (navbar updates)"""
+    """Consumer for global notifications (navbar updates).
+
+    Pushes authoritative unread counts on connect and whenever an
+    ``unread_update`` arrives for the user. Bursts of updates are coalesced
+    into one recount per UNREAD_COALESCE_DELAY. New or changed post
+    notifications are forwarded as they arrive, already rendered.
+    """
     async def connect(self):
         user = self.scope["user"]
         if not user.is_authenticated:
             await self.close(code=4401)
             return
         
+        self.user = user
         self.user_group_name = f'user_{user.id}_notifications'
+        self.pending_refresh = None
         
         await self.channel_layer.group_add(
             self.user_group_name,
             self.channel_name
         )
         await self.accept()
+        await self.send_counts()
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.user_group_name,
-            self.channel_name
-        )
+        if getattr(self, 'pending_refresh', None):
+            self.pending_refresh.cancel()
+        if hasattr(self, 'user_group_name'):
+            await self.channel_layer.group_discard(
+                self.user_group_name,
+                self.channel_name
+            )
 
     async def unread_update(self, event):
-        """Send unread count update to client"""
+        """Schedule a recount unless one is already pending"""
+        if self.pending_refresh is None or self.pending_refresh.done():
+            self.pending_refresh = asyncio.ensure_future(self.refresh_counts())
+
+    async def notification_event(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'notification',
+            'id': event['id'],
+            'notification_type': event['notification_type'],
+            'message': event['message'],
+            'html': event['html'],
+        }))
+
+    async def notification_removed(self, event):
         await self.send(text_data=json.dumps({
-            'type': 'unread_update',
-            'action': event['action']
-        }))
\ No newline at end of file
+            'type': 'notification_removed',
+            'id': event['id'],
+        }))
+
+    async def refresh_counts(self):
+        await asyncio.sleep(UNREAD_COALESCE_DELAY)
+        # Something changed, so recount rather than trust a cached number
+        await self.send_counts(fresh=True)
+
+    async def send_counts(self, fresh=False):
+        counts = await self.get_counts(fresh)
+        await self.send(text_data=json.dumps({
+            'type': 'unread_counts',
+            **counts
+        }))
+
+    @database_sync_to_async
+    def get_counts(self, fresh=False):
+        chat_total, chat_rooms = UnreadCounter.totals_for_user(self.user)
+        return {
+            'chat': chat_total,
+            'chat_rooms': chat_rooms,
+            'notifications': Notification.unread_count(self.user.id, fresh=fresh)
+        }
\ No newline at end of file
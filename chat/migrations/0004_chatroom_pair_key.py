@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:33
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def dedupe_and_key_rooms(apps, schema_editor):
+    """Merge duplicate rooms for the same pair into the oldest one and fill
+    in the pair key"""
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    UnreadCounter = apps.get_model('chat', 'UnreadCounter')
+
+    rooms_by_pair = defaultdict(list)
+    for room in ChatRoom.objects.prefetch_related('users').order_by('created_at', 'id'):
+        user_ids = sorted(user.id for user in room.users.all())
+        if len(user_ids) == 2:
+            rooms_by_pair[tuple(user_ids)].append(room)
+
+    for (low, high), rooms in rooms_by_pair.items():
+        keeper, duplicates = rooms[0], [room.id for room in rooms[1:]]
+        if duplicates:
+            Message.objects.filter(room_id__in=duplicates).update(room=keeper)
+            ChatRoom.objects.filter(id__in=duplicates).delete()
+            for user_id in (low, high):
+                count = Message.objects.filter(room=keeper, is_read=False).exclude(sender_id=user_id).count()
+                UnreadCounter.objects.update_or_create(room=keeper, user_id=user_id, defaults={'count': count})
+        keeper.user_low_id, keeper.user_high_id = low, high
+        keeper.save(update_fields=['user_low', 'user_high'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_unreadcounter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='user_high',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='user_low',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(dedupe_and_key_rooms, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(fields=('user_low', 'user_high'), name='unique_chat_room_pair'),
+        ),
+    ]
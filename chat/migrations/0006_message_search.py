@@ -0,0 +1,56 @@
+from django.db import migrations
+
+SQLITE_INDEX = [
+    """CREATE VIRTUAL TABLE chat_message_fts USING fts5(
+        text, content='chat_message', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    # Triggers rather than signals: messages are written with bulk_create
+    """CREATE TRIGGER chat_message_fts_ai AFTER INSERT ON chat_message BEGIN
+        INSERT INTO chat_message_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+    """CREATE TRIGGER chat_message_fts_ad AFTER DELETE ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END""",
+    """CREATE TRIGGER chat_message_fts_au AFTER UPDATE OF text ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO chat_message_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+]
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS chat_message_fts_au',
+    'DROP TRIGGER IF EXISTS chat_message_fts_ad',
+    'DROP TRIGGER IF EXISTS chat_message_fts_ai',
+    'DROP TABLE IF EXISTS chat_message_fts',
+]
+POSTGRES_INDEX = [
+    """ALTER TABLE chat_message ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('simple', text)) STORED""",
+    'CREATE INDEX chat_message_search_idx ON chat_message USING GIN (search_vector)',
+]
+POSTGRES_DROP = [
+    'DROP INDEX IF EXISTS chat_message_search_idx',
+    'ALTER TABLE chat_message DROP COLUMN IF EXISTS search_vector',
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_history_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_INDEX, 'postgresql': POSTGRES_INDEX}),
+            run({'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP}),
+        ),
+    ]
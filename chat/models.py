@@ -1,20 +1,64 @@
-from django.db import models
+from django.db import connection, models, transaction, IntegrityError
+from django.db.models import Exists, OuterRef, F, Q
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils.dateparse import parse_datetime
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from core import search
+from userapp.models import Friendship
+
+# How long a resolved room context is reused across socket reconnects
+ROOM_CONTEXT_TIMEOUT = 300
+
+# Messages per page of chat history
+CHAT_HISTORY_PAGE_SIZE = 50
+# Matches per page of chat search results
+CHAT_SEARCH_PAGE_SIZE = 20
+
+def push_unread_update(user_id):
+    """Ask the user's notification sockets to push fresh unread counts once
+    the current transaction commits"""
+    channel_layer = get_channel_layer()
+    transaction.on_commit(lambda: async_to_sync(channel_layer.group_send)(
+        f'user_{user_id}_notifications',
+        {'type': 'unread_update'}
+    ))
 
 class ChatRoom(models.Model):
     users = models.ManyToManyField(User, related_name='chat_rooms')
+    # Canonical pair key: the lower and higher user id of the two participants
+    user_low = models.ForeignKey(User, on_delete=models.CASCADE, null=True, related_name='+')
+    user_high = models.ForeignKey(User, on_delete=models.CASCADE, null=True, related_name='+')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='unique_chat_room_pair'),
+        ]
+
     def __str__(self):
         return " & ".join([u.username for u in self.users.all()])
 
+    @staticmethod
+    def pair_key(user1, user2):
+        return tuple(sorted((user1.id, user2.id)))
+
+    @staticmethod
+    def get_room(user1, user2):
+        """Return the room between two users, or None"""
+        low, high = ChatRoom.pair_key(user1, user2)
+        return ChatRoom.objects.filter(user_low_id=low, user_high_id=high).first()
+
     @staticmethod
     def get_or_create_room(user1, user2):
-        rooms = ChatRoom.objects.filter(users=user1).filter(users=user2)
-        if rooms.exists():
-            return rooms.first()
-        room = ChatRoom.objects.create()
-        room.users.add(user1, user2)
+        low, high = ChatRoom.pair_key(user1, user2)
+        with transaction.atomic():
+            # The unique pair constraint makes concurrent creates collapse
+            # into one room
+            room, created = ChatRoom.objects.get_or_create(user_low_id=low, user_high_id=high)
+            if created:
+                room.users.add(low, high)
         return room
     
     def get_other_user(self, current_user):
@@ -22,9 +66,78 @@ class ChatRoom(models.Model):
         users = self.users.exclude(id=current_user.id)
         return users.first() if users.exists() else None
     
+    @staticmethod
+    def context_cache_key(room_id, user_id):
+        return f'chat_room_context_{room_id}_{user_id}'
+
+    @staticmethod
+    def load_context(room_id, user):
+        """Resolve the peer and mutual-follow status of a room for user.
+
+        Both participants and the friendship flag come back from a single
+        query. Returns None if the room doesn't exist, otherwise a dict with
+        ``is_member`` and ``is_friend`` flags plus the peer's id and username.
+        Friend contexts are cached until either side unfollows.
+        """
+        key = ChatRoom.context_cache_key(room_id, user.id)
+        context = cache.get(key)
+        if context is not None:
+            return context
+
+        members = list(
+            User.objects.filter(chat_rooms__id=room_id)
+            .annotate(is_friend=Exists(Friendship.objects.filter(user_id=user.id, friend=OuterRef('pk'))))
+            .only('id', 'username')
+        )
+        if not members:
+            return None
+
+        peers = [m for m in members if m.id != user.id]
+        is_member = len(members) == 2 and len(peers) == 1
+        peer = peers[0] if is_member else None
+        context = {
+            'room_id': room_id,
+            'is_member': is_member,
+            'is_friend': bool(peer and peer.is_friend),
+            'peer_id': peer.id if peer else None,
+            'peer_username': peer.username if peer else None,
+        }
+        if context['is_friend']:
+            cache.set(key, context, ROOM_CONTEXT_TIMEOUT)
+        return context
+
+    @staticmethod
+    def invalidate_context(user1_id, user2_id):
+        """Drop cached contexts for the room between two users and
+        disconnect any open chat sockets, e.g. after their friendship ends.
+        Called by Friendship.sync once the change has committed."""
+        low, high = sorted((user1_id, user2_id))
+        room_id = ChatRoom.objects.filter(user_low_id=low, user_high_id=high).values_list('id', flat=True).first()
+        if not room_id:
+            return
+        cache.delete_many([
+            ChatRoom.context_cache_key(room_id, user1_id),
+            ChatRoom.context_cache_key(room_id, user2_id),
+        ])
+        async_to_sync(get_channel_layer().group_send)(
+            f'chat_{room_id}',
+            {'type': 'room_context_invalidated'}
+        )
+
     def unread_count_for_user(self, user):
         """Get unread message count for a specific user"""
-        return self.messages.filter(is_read=False).exclude(sender=user).count()
+        counter = self.unread_counters.filter(user=user).first()
+        return counter.count if counter else 0
+
+    @staticmethod
+    def mark_read(room_id, user_id):
+        """Mark the room's messages as read for a user and zero their counter"""
+        with transaction.atomic():
+            # Lock the counter first so a concurrent send either lands before
+            # our UPDATE sees its message or increments after we reset
+            list(UnreadCounter.objects.select_for_update().filter(room_id=room_id, user_id=user_id))
+            Message.objects.filter(room_id=room_id, is_read=False).exclude(sender_id=user_id).update(is_read=True)
+            UnreadCounter.objects.filter(room_id=room_id, user_id=user_id).update(count=0)
 
 class Message(models.Model):
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
@@ -35,6 +148,162 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['room', 'timestamp', 'id'], name='chat_message_history_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender.username}: {self.text[:30]}"
+
+    @property
+    def cursor(self):
+        """Keyset position of this message, for loading what came before it"""
+        return f"{self.timestamp.isoformat()}|{self.id}"
+
+    @staticmethod
+    def parse_cursor(cursor):
+        """Return (timestamp, id) from a cursor string, or None if invalid"""
+        try:
+            timestamp, pk = cursor.rsplit('|', 1)
+            timestamp = parse_datetime(timestamp)
+            pk = int(pk)
+        except (AttributeError, ValueError):
+            return None
+        return (timestamp, pk) if timestamp else None
+
+    @staticmethod
+    def history(room_id, before=None, limit=CHAT_HISTORY_PAGE_SIZE):
+        """Return up to ``limit`` messages older than the ``before`` cursor
+        (or the latest ones), oldest first, and whether older ones remain"""
+        messages = Message.objects.filter(room_id=room_id).select_related('sender')
+        position = Message.parse_cursor(before) if before else None
+        if position:
+            timestamp, pk = position
+            messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+
+        page = list(messages.order_by('-timestamp', '-id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        page.reverse()
+        return page, has_more
+
+    @staticmethod
+    def around(room_id, at, limit=CHAT_HISTORY_PAGE_SIZE):
+        """Return the messages either side of the ``at`` cursor, oldest
+        first, whether older ones remain and whether newer ones remain"""
+        position = Message.parse_cursor(at) if at else None
+        if not position:
+            return (*Message.history(room_id, limit=limit), False)
+        timestamp, pk = position
+        messages = Message.objects.filter(room_id=room_id).select_related('sender')
+        half = limit // 2
+        older = list(
+            messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lte=pk))
+            .order_by('-timestamp', '-id')[:half + 1]
+        )
+        newer = list(
+            messages.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk))
+            .order_by('timestamp', 'id')[:half + 1]
+        )
+        page = older[:half][::-1] + newer[:half]
+        return page, len(older) > half, len(newer) > half
+
+    @staticmethod
+    def search(user, term, room_id=None, before=None, limit=CHAT_SEARCH_PAGE_SIZE):
+        """Messages matching ``term`` in the rooms ``user`` belongs to (or
+        just ``room_id``), newest first, older than the ``before`` cursor.
+
+        Returns the page and whether more remain. Each message carries a
+        highlighted ``snippet``. Matching goes through the full-text index
+        on chat_message (migration chat/0006_message_search), and only
+        rooms listed in ChatRoom.users for ``user`` are searched.
+        """
+        words = search.tokens(term)
+        if not words:
+            return [], False
+        conditions = ['m.room_id IN (SELECT chatroom_id FROM chat_chatroom_users WHERE user_id = %s)']
+        params = [user.id]
+        if room_id is not None:
+            conditions.append('m.room_id = %s')
+            params.append(room_id)
+        position = Message.parse_cursor(before) if before else None
+        if position:
+            timestamp = connection.ops.adapt_datetimefield_value(position[0])
+            conditions.append('(m.timestamp < %s OR (m.timestamp = %s AND m.id < %s))')
+            params += [timestamp, timestamp, position[1]]
+        where = ' AND '.join(conditions)
+        match = search.match_expression(words)
+        if connection.vendor == 'postgresql':
+            sql = f"""
+                SELECT m.id, ts_headline('{search.PG_CONFIG}', m.text, q, %s)
+                FROM chat_message m, to_tsquery('{search.PG_CONFIG}', %s) q
+                WHERE m.search_vector @@ q AND {where}
+                ORDER BY m.timestamp DESC, m.id DESC
+                LIMIT %s
+            """
+            params = [search.HEADLINE_OPTIONS, match, *params, limit + 1]
+        else:
+            sql = f"""
+                SELECT m.id, snippet(chat_message_fts, 0, %s, %s, '…', {search.SNIPPET_WORDS})
+                FROM chat_message_fts JOIN chat_message m ON m.id = chat_message_fts.rowid
+                WHERE chat_message_fts MATCH %s AND {where}
+                ORDER BY m.timestamp DESC, m.id DESC
+                LIMIT %s
+            """
+            params = [search.HIGHLIGHT_START, search.HIGHLIGHT_END, match, *params, limit + 1]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        messages = Message.objects.select_related(
+            'sender', 'room__user_low', 'room__user_high',
+        ).in_bulk([pk for pk, _ in rows])
+        page = []
+        for pk, snippet in rows:
+            message = messages.get(pk)
+            if message is None:
+                continue
+            message.snippet = search.highlight(snippet)
+            room = message.room
+            message.peer = room.user_high if room.user_low_id == user.id else room.user_low
+            page.append(message)
+        return page, has_more
+
+class UnreadCounter(models.Model):
+    """Denormalized unread message count per (user, room).
+
+    Incremented alongside every message insert and zeroed when the user
+    reads the room, so totals come from one indexed read instead of a COUNT
+    per room.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='unread_counters')
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='unread_counters')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'room')
+
+    def __str__(self):
+        return f"{self.user.username} in room {self.room_id}: {self.count}"
+
+    @staticmethod
+    def increment(room_id, user_id, by=1):
+        updated = UnreadCounter.objects.filter(room_id=room_id, user_id=user_id).update(count=F('count') + by)
+        if updated:
+            return
+        try:
+            with transaction.atomic():
+                UnreadCounter.objects.create(room_id=room_id, user_id=user_id, count=by)
+        except IntegrityError:
+            # Someone else created it first
+            UnreadCounter.objects.filter(room_id=room_id, user_id=user_id).update(count=F('count') + by)
+
+    @staticmethod
+    def totals_for_user(user, exclude_room=None):
+        """Return (total, {room_id: count}) for rooms with unread messages"""
+        counters = UnreadCounter.objects.filter(user=user, count__gt=0)
+        if exclude_room:
+            counters = counters.exclude(room_id=exclude_room)
+        rooms = dict(counters.values_list('room_id', 'count'))
+        return sum(rooms.values()), rooms
@@ -4,5 +4,6 @@ from . import views
 urlpatterns = [
     path('', views.chat_list, name='chat_list'),
     path('room/<str:username>/', views.chat_room, name='chat_room'),
+    path('search/', views.chat_search, name='chat_search'),
     path('unread-count/', views.unread_count, name='chat_unread_count'),
 ]
\ No newline at end of file
@@ -1,61 +1,102 @@
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.http import JsonResponse
-from .models import ChatRoom, Message
+from core.views import render_page
+from userapp.friends import are_friends
+from .models import ChatRoom, Message, UnreadCounter, push_unread_update
+
+CHAT_LIST_PAGE_SIZE = 20
 
 @login_required
 def chat_list(request):
-    # Get all friends with their chat rooms and unread counts
-    friends_data = []
-    for user in User.objects.exclude(id=request.user.id):
-        if (request.user.profile.is_following(user) and 
-            user.profile.is_following(request.user)):
-            # Get or create room to check unread count
-            room = ChatRoom.get_or_create_room(request.user, user)
-            unread = room.unread_count_for_user(request.user)
-            friends_data.append({
-                'user': user,
-                'room': room,
-                'unread_count': unread
-            })
-    
-    return render(request, 'chat/chat_list.html', {'friends_data': friends_data})
+    # Mutual follows with their room, unread count and last message, in one
+    # query; rooms are only created when a chat is actually opened
+    me = request.user
+    shared_room = ChatRoom.objects.filter(
+        Q(user_low=me, user_high=OuterRef('pk')) | Q(user_low=OuterRef('pk'), user_high=me)
+    )
+    last_message = Message.objects.filter(room_id=OuterRef('room_id')).order_by('-timestamp', '-id')
+    friends = (
+        User.objects
+        .filter(friendships__friend=me)
+        .select_related('profile')
+        .annotate(room_id=Subquery(shared_room.values('id')[:1]))
+        .annotate(
+            unread_count=Coalesce(Subquery(
+                UnreadCounter.objects.filter(user=me, room_id=OuterRef('room_id')).values('count')[:1]
+            ), 0),
+            last_message=Subquery(last_message.values('text')[:1]),
+            last_message_at=Subquery(last_message.values('timestamp')[:1]),
+        )
+        .order_by(F('last_message_at').desc(nulls_last=True), 'username')
+    )
+
+    page = Paginator(friends, CHAT_LIST_PAGE_SIZE).get_page(request.GET.get('page'))
+
+    return render(request, 'chat/chat_list.html', {'friends': page, 'page_obj': page})
 
 @login_required
 def chat_room(request, username):
     friend = get_object_or_404(User, username=username)
     
     # Check if they are friends
-    if not (request.user.profile.is_following(friend) and 
-            friend.profile.is_following(request.user)):
+    if not are_friends(request.user, friend):
         return render(request, 'chat/not_friend.html', {'friend': friend})
     
     # Get or create chat room
     room = ChatRoom.get_or_create_room(request.user, friend)
     
     # Mark all messages in this room as read for current user
-    room.messages.filter(is_read=False).exclude(sender=request.user).update(is_read=True)
+    ChatRoom.mark_read(room.id, request.user.id)
+    push_unread_update(request.user.id)
     
-    messages = room.messages.all()
+    # Only the most recent window, or the one around a search result's
+    # ?at= cursor; older pages are streamed over the socket
+    at = request.GET.get('at')
+    position = Message.parse_cursor(at) if at else None
+    messages, has_more, has_newer = Message.around(room.id, at)
     
     return render(request, 'chat/chat_room.html', {
         'room': room,
         'friend': friend,
         'messages': messages,
+        'has_more': has_more,
+        'has_newer': has_newer,
+        'target_id': position[1] if position else None,
+        'oldest_cursor': messages[0].cursor if messages else '',
         'current_room_id': room.id  # Pass this to template
     })
 
+@login_required
+def chat_search(request):
+    """Search the user's conversations, optionally just the room with
+    ?with=<username>, newest matches first"""
+    query = request.GET.get('q', '').strip()
+    peer = None
+    room_id = None
+    if request.GET.get('with'):
+        peer = get_object_or_404(User, username=request.GET['with'])
+        room = ChatRoom.get_room(request.user, peer)
+        room_id = room.id if room else 0
+    results, has_more = Message.search(request.user, query, room_id=room_id, before=request.GET.get('before'))
+    next_cursor = results[-1].cursor if results and has_more else None
+    return render_page(
+        request, 'chat/search.html', 'chat/_search_results.html',
+        {'results': results}, has_more, next_cursor, {'query': query, 'peer': peer},
+    )
+
 @login_required
 def unread_count(request):
-    """API endpoint to get total unread message count, excluding current room"""
+    """API endpoint to get total and per-room unread message counts,
+    excluding the currently open room"""
     current_room_id = request.GET.get('exclude_room')  # Get room to exclude
-    
-    total_unread = 0
-    for room in request.user.chat_rooms.all():
-        # Skip the currently open chat room
-        if current_room_id and str(room.id) == current_room_id:
-            continue
-        total_unread += room.unread_count_for_user(request.user)
-    
-    return JsonResponse({'count': total_unread})
+    if current_room_id and not current_room_id.isdigit():
+        current_room_id = None
+
+    total_unread, rooms = UnreadCounter.totals_for_user(request.user, exclude_room=current_room_id)
+
+    return JsonResponse({'count': total_unread, 'rooms': rooms})
@@ -0,0 +1,103 @@
+import asyncio
+import atexit
+from collections import Counter
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from .models import Message, UnreadCounter
+
+
+class MessageWriter:
+    """Write-behind buffer for chat messages.
+
+    Consumers broadcast a message first and hand the unsaved instance and
+    its recipient to ``enqueue``, which returns a future resolved with the
+    stored message (id and timestamp set) once the row and the recipient's
+    unread counter are committed. Messages are
+    written with ``bulk_create`` in batches of up to ``batch_size`` or every
+    ``flush_interval`` seconds, whichever comes first.
+    When ``max_pending`` messages are waiting, ``enqueue`` blocks until a
+    flush frees room, pushing back on the sending socket.
+    """
+
+    def __init__(self, batch_size=200, flush_interval=0.05, max_pending=5000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.buffer = []
+        self._slots = None
+        self._wakeup = None
+        self._lock = None
+        self._task = None
+        atexit.register(self._flush_on_exit)
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._slots = asyncio.Semaphore(self.max_pending)
+            self._wakeup = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def enqueue(self, message, recipient_id):
+        self._ensure_started()
+        await self._slots.acquire()
+        future = asyncio.get_running_loop().create_future()
+        self.buffer.append((message, recipient_id, future))
+        if len(self.buffer) >= self.batch_size:
+            self._wakeup.set()
+        return future
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write everything buffered so far"""
+        if self._lock is None:
+            return
+        async with self._lock:
+            while self.buffer:
+                batch = self.buffer[:self.batch_size]
+                del self.buffer[:self.batch_size]
+                await self._write(batch)
+
+    async def _write(self, batch):
+        try:
+            await database_sync_to_async(self._persist)(batch)
+        except Exception as exc:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+        else:
+            for message, _, future in batch:
+                if not future.done():
+                    future.set_result(message)
+        finally:
+            for _ in batch:
+                self._slots.release()
+
+    @staticmethod
+    def _persist(batch):
+        unread = Counter((message.room_id, recipient_id) for message, recipient_id, _ in batch)
+        with transaction.atomic():
+            Message.objects.bulk_create([message for message, _, _ in batch])
+            for (room_id, recipient_id), count in unread.items():
+                UnreadCounter.increment(room_id, recipient_id, by=count)
+
+    def _flush_on_exit(self):
+        """Persist anything still buffered when the process exits"""
+        if self.buffer:
+            self._persist(self.buffer)
+            self.buffer = []
+
+
+message_writer = MessageWriter(
+    batch_size=settings.CHAT_WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=settings.CHAT_WRITE_BEHIND_FLUSH_INTERVAL,
+    max_pending=settings.CHAT_WRITE_BEHIND_MAX_PENDING,
+)
@@ -11,14 +11,17 @@ import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
-import chat.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 django_asgi_app = get_asgi_application()
 
+# Imported once the app registry is ready (they load models)
+import chat.routing
+from core.media import MediaFilesApplication
+
 application = ProtocolTypeRouter({
-    "http": django_asgi_app,
+    "http": MediaFilesApplication(django_asgi_app),
     "websocket": AuthMiddlewareStack(
         URLRouter(
             chat.routing.websocket_urlpatterns
@@ -0,0 +1,196 @@
+import asyncio
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+
+from .storage import BLOB_DIR, ContentAddressedStorage
+
+# Blob names change whenever content does, so clients and CDNs may keep them
+BLOB_MAX_AGE = 365 * 24 * 60 * 60
+# Read size when the file has to go through Python
+STREAM_CHUNK_SIZE = 256 * 1024
+# A single byte range; multiple ranges are answered with the whole file
+RANGE_RE = re.compile(r'^bytes=\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+def file_headers(name, st):
+    """Validator and caching headers for a media file"""
+    digest = ContentAddressedStorage.digest_of(name)
+    if digest:
+        etag = f'"{digest}"'
+        cache_control = f'public, max-age={BLOB_MAX_AGE}, immutable'
+    else:
+        etag = f'W/"{int(st.st_mtime)}-{st.st_size}"'
+        cache_control = 'public, no-cache'
+    return {
+        'ETag': etag,
+        'Last-Modified': http_date(st.st_mtime),
+        'Cache-Control': cache_control,
+    }
+
+
+def etag_matches(header, etag, weak=True):
+    """True if an If-None-Match / If-Range style header lists ``etag``.
+    With ``weak`` the W/ prefix is ignored on both sides."""
+    if header.strip() == '*':
+        return True
+    if weak:
+        etag = etag.removeprefix('W/')
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if weak:
+            candidate = candidate.removeprefix('W/')
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified(headers, validators, st):
+    """Whether a conditional GET can be answered with 304"""
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        return etag_matches(if_none_match, validators['ETag'])
+    since = parse_http_date_safe(headers.get('if-modified-since', ''))
+    return since is not None and int(st.st_mtime) <= since
+
+
+def parse_range(header, size):
+    """Parse a Range header into an inclusive (start, end) pair.
+
+    Returns None when the whole file should be sent (no header, a
+    malformed one, or several ranges) and raises ValueError when the range
+    can't be satisfied.
+    """
+    match = RANGE_RE.match(header or '')
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if not length or not size:
+            raise ValueError('Range not satisfiable')
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+
+class MediaFilesApplication:
+    """ASGI wrapper that serves MEDIA_URL before Django sees the request.
+
+    Handles conditional requests and single byte ranges (video seeking).
+    Bodies are handed off instead of read through Python where possible:
+    MEDIA_SENDFILE = "nginx" responds with X-Accel-Redirect to the internal
+    MEDIA_ACCEL_PREFIX location, "apache" with X-Sendfile, and servers that
+    support the ASGI zero-copy send extension get the open file. Otherwise
+    the file is streamed in large chunks read off the event loop.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.prefix = settings.MEDIA_URL
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not scope['path'].startswith(self.prefix):
+            return await self.application(scope, receive, send)
+        if scope['method'] not in ('GET', 'HEAD'):
+            return await self.respond(send, 405, {'Allow': 'GET, HEAD'})
+        await self.serve(scope, send, scope['path'][len(self.prefix):])
+
+    async def serve(self, scope, send, name):
+        try:
+            path = safe_join(settings.MEDIA_ROOT, name)
+        except SuspiciousFileOperation:
+            return await self.respond(send, 404)
+        if name.startswith(f'{BLOB_DIR}/tmp/'):
+            return await self.respond(send, 404)
+        try:
+            st = await asyncio.to_thread(os.stat, path)
+        except OSError:
+            return await self.respond(send, 404)
+        if not stat.S_ISREG(st.st_mode):
+            return await self.respond(send, 404)
+
+        headers = {key.decode('latin-1'): value.decode('latin-1') for key, value in scope['headers']}
+        validators = file_headers(name, st)
+        if not_modified(headers, validators, st):
+            return await self.respond(send, 304, validators)
+
+        content_type, encoding = mimetypes.guess_type(path)
+        response_headers = {
+            **validators,
+            'Content-Type': content_type or 'application/octet-stream',
+            'Accept-Ranges': 'bytes',
+        }
+        if encoding:
+            response_headers['Content-Encoding'] = encoding
+
+        # The front-end server takes over, ranges included
+        if settings.MEDIA_SENDFILE == 'nginx':
+            response_headers['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + name
+            return await self.respond(send, 200, response_headers)
+        if settings.MEDIA_SENDFILE == 'apache':
+            response_headers['X-Sendfile'] = path
+            return await self.respond(send, 200, response_headers)
+
+        start, end, status = 0, st.st_size - 1, 200
+        if_range = headers.get('if-range')
+        if if_range is None or etag_matches(if_range, validators['ETag'], weak=False):
+            try:
+                byte_range = parse_range(headers.get('range'), st.st_size)
+            except ValueError:
+                return await self.respond(send, 416, {'Content-Range': f'bytes */{st.st_size}'})
+            if byte_range:
+                start, end = byte_range
+                status = 206
+                response_headers['Content-Range'] = f'bytes {start}-{end}/{st.st_size}'
+        length = end - start + 1
+        response_headers['Content-Length'] = str(length)
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(key.encode('latin-1'), value.encode('latin-1')) for key, value in response_headers.items()],
+        })
+        if scope['method'] == 'HEAD' or not length:
+            return await send({'type': 'http.response.body', 'body': b''})
+
+        with open(path, 'rb') as f:
+            if 'http.response.zerocopysend' in scope.get('extensions', {}):
+                return await send({
+                    'type': 'http.response.zerocopysend',
+                    'file': f,
+                    'offset': start,
+                    'count': length,
+                })
+            await asyncio.to_thread(f.seek, start)
+            remaining = length
+            while remaining:
+                chunk = await asyncio.to_thread(f.read, min(remaining, STREAM_CHUNK_SIZE))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': bool(remaining)})
+            if remaining:
+                # The file shrank underneath us; end the response
+                await send({'type': 'http.response.body', 'body': b''})
+
+    @staticmethod
+    async def respond(send, status, headers=None):
+        headers = dict(headers or {})
+        headers.setdefault('Content-Length', '0')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(key.encode('latin-1'), value.encode('latin-1')) for key, value in headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': b''})
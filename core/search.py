@@ -0,0 +1,130 @@
+import re
+from collections import namedtuple
+
+from django.apps import apps
+from django.db import IntegrityError, connection, transaction
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+# Full-text search over posts, comments and users. Each searchable object
+# has one posts.SearchDocument row holding its text; signal receivers in
+# the apps keep those rows current. The inverted index over them lives in
+# the database: an FTS5 table kept in step by triggers on SQLite, a
+# generated tsvector column with a GIN index on PostgreSQL (see migration
+# posts/0011_searchdocument). Lookups go through the index, so their cost
+# follows the number of matches rather than the size of the tables.
+# Chat messages are indexed in place instead (see Message.search).
+
+SEARCH_TABLE = 'posts_searchdocument'
+FTS_TABLE = 'posts_searchdocument_fts'
+# PostgreSQL text search configuration: no stemming, so names and mixed
+# languages match as typed
+PG_CONFIG = 'simple'
+# Matched terms in snippets are wrapped in these before escaping
+HIGHLIGHT_START, HIGHLIGHT_END = '\x02', '\x03'
+SNIPPET_WORDS = 16
+HEADLINE_OPTIONS = (
+    f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, '
+    f'MaxWords={SNIPPET_WORDS}, MinWords={SNIPPET_WORDS // 2}'
+)
+# The admin filters its changelist to at most this many best matches
+ADMIN_RESULT_LIMIT = 1000
+
+TOKEN_RE = re.compile(r'\w+')
+
+Hit = namedtuple('Hit', 'kind object_id rank snippet')
+
+
+def index(kind, object_id, body):
+    """Store the text for one object, replacing what was indexed before.
+    Blank text removes the object from the index."""
+    body = body.strip()
+    if not body:
+        return unindex(kind, object_id)
+    SearchDocument = apps.get_model('posts', 'SearchDocument')
+    # Unchanged text is skipped so the triggers don't rewrite the index
+    rows = SearchDocument.objects.filter(kind=kind, object_id=object_id)
+    if rows.exclude(body=body).update(body=body) or rows.exists():
+        return
+    try:
+        with transaction.atomic():
+            SearchDocument.objects.create(kind=kind, object_id=object_id, body=body)
+    except IntegrityError:
+        rows.update(body=body)
+
+
+def unindex(kind, object_id):
+    apps.get_model('posts', 'SearchDocument').objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def tokens(term):
+    return TOKEN_RE.findall(term or '')
+
+
+def match_expression(words):
+    """Query text matching documents that contain every word, the last one
+    as a prefix so results show up while typing"""
+    if connection.vendor == 'postgresql':
+        terms = [f"'{word}'" for word in words]
+        terms[-1] += ':*'
+        return ' & '.join(terms)
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search(term, kinds, offset=0, limit=20):
+    """Best matches for ``term`` among documents of the given kinds, as
+    Hits ordered by relevance"""
+    words = tokens(term)
+    if not words or not kinds:
+        return []
+    match = match_expression(words)
+    kinds = list(kinds)
+    if connection.vendor == 'postgresql':
+        sql = f"""
+            SELECT d.kind, d.object_id, ts_rank_cd(d.vector, q) AS rank,
+                   ts_headline('{PG_CONFIG}', d.body, q, %s)
+            FROM {SEARCH_TABLE} d, to_tsquery('{PG_CONFIG}', %s) q
+            WHERE d.vector @@ q AND d.kind = ANY(%s)
+            ORDER BY rank DESC, d.id DESC
+            LIMIT %s OFFSET %s
+        """
+        params = [HEADLINE_OPTIONS, match, kinds, limit, offset]
+    else:
+        placeholders = ', '.join(['%s'] * len(kinds))
+        sql = f"""
+            SELECT d.kind, d.object_id, bm25({FTS_TABLE}) AS rank,
+                   snippet({FTS_TABLE}, 0, %s, %s, '…', {SNIPPET_WORDS})
+            FROM {FTS_TABLE} JOIN {SEARCH_TABLE} d ON d.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH %s AND d.kind IN ({placeholders})
+            ORDER BY rank, d.id DESC
+            LIMIT %s OFFSET %s
+        """
+        params = [HIGHLIGHT_START, HIGHLIGHT_END, match, *kinds, limit, offset]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [Hit(*row) for row in cursor.fetchall()]
+
+
+def matching_ids(kind, term, limit=ADMIN_RESULT_LIMIT):
+    """Ids of the best matching objects of one kind"""
+    return [hit.object_id for hit in search(term, [kind], limit=limit)]
+
+
+def highlight(snippet):
+    """Escape a snippet and turn its match markers into <mark> tags"""
+    return mark_safe(
+        escape(snippet).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>')
+    )
+
+
+class IndexedSearchMixin:
+    """ModelAdmin mixin answering the changelist search box from the
+    full-text index instead of icontains scans over ``search_fields``"""
+    search_kind = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not tokens(search_term):
+            return queryset, False
+        return queryset.filter(pk__in=matching_ids(self.search_kind, search_term)), False
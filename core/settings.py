@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -75,10 +76,93 @@ TEMPLATES = [
 WSGI_APPLICATION = 'core.wsgi.application'
 ASGI_APPLICATION = 'core.asgi.application'
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+# Channel layer
+# Set CHANNEL_REDIS_HOSTS to a comma-separated list of redis:// URLs to share
+# groups across Daphne workers. channels_redis consistently hashes groups and
+# channels over the listed hosts, so adding hosts spreads chat fan-out.
+# Without it we fall back to the in-process layer (single worker only).
+CHANNEL_REDIS_HOSTS = [
+    host.strip()
+    for host in os.environ.get('CHANNEL_REDIS_HOSTS', '').split(',')
+    if host.strip()
+]
+
+CHANNEL_LAYER_CONFIG = {
+    # Max queued messages per channel before ChannelFull is raised
+    'capacity': int(os.environ.get('CHANNEL_CAPACITY', 1500)),
+    # Seconds an undelivered message lives in a channel
+    'expiry': int(os.environ.get('CHANNEL_EXPIRY', 60)),
+    # Seconds a channel stays in a group without being re-added
+    'group_expiry': int(os.environ.get('CHANNEL_GROUP_EXPIRY', 86400)),
+}
+
+if CHANNEL_REDIS_HOSTS:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": CHANNEL_REDIS_HOSTS,
+                "prefix": os.environ.get('CHANNEL_PREFIX', 'asgi'),
+                **CHANNEL_LAYER_CONFIG,
+            },
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+            "CONFIG": CHANNEL_LAYER_CONFIG,
+        }
     }
+
+# Chat write-behind persistence
+# When enabled, chat messages are broadcast immediately and written to the
+# database in micro-batches (see chat/writer.py) instead of one INSERT each.
+CHAT_WRITE_BEHIND = os.environ.get('CHAT_WRITE_BEHIND', '') == '1'
+CHAT_WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('CHAT_WRITE_BEHIND_BATCH_SIZE', 200))
+CHAT_WRITE_BEHIND_FLUSH_INTERVAL = float(os.environ.get('CHAT_WRITE_BEHIND_FLUSH_INTERVAL', 0.05))
+CHAT_WRITE_BEHIND_MAX_PENDING = int(os.environ.get('CHAT_WRITE_BEHIND_MAX_PENDING', 5000))
+
+# Post card fragment cache
+# Rendered post cards are cached under the "fragments" alias. Pick the
+# backend with POST_FRAGMENT_CACHE: "locmem" (per process, the default),
+# "file" (shared by the workers on one host) or "redis" (any server that
+# speaks the Redis protocol, at POST_FRAGMENT_CACHE_LOCATION).
+FRAGMENT_CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'post-fragments'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / 'cache' / 'fragments')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/1'),
+}
+_fragment_backend, _fragment_location = FRAGMENT_CACHE_BACKENDS[os.environ.get('POST_FRAGMENT_CACHE', 'locmem')]
+
+# Default cache
+# Friend sets, chat room contexts and unread notification counts are cached
+# here and deleted on change, so every worker has to see the same cache.
+# With CHANNEL_REDIS_HOSTS set (several Daphne workers) it is a Redis cache
+# at DEFAULT_CACHE_LOCATION, by default the first channel layer host.
+# A single development process keeps the per-process LocMemCache.
+DEFAULT_CACHE_LOCATION = os.environ.get(
+    'DEFAULT_CACHE_LOCATION', CHANNEL_REDIS_HOSTS[0] if CHANNEL_REDIS_HOSTS else ''
+)
+if DEFAULT_CACHE_LOCATION:
+    _default_cache = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': DEFAULT_CACHE_LOCATION,
+        'KEY_PREFIX': os.environ.get('DEFAULT_CACHE_PREFIX', 'cache'),
+    }
+else:
+    _default_cache = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+
+CACHES = {
+    'default': _default_cache,
+    'fragments': {
+        'BACKEND': _fragment_backend,
+        'LOCATION': os.environ.get('POST_FRAGMENT_CACHE_LOCATION', _fragment_location),
+        'TIMEOUT': int(os.environ.get('POST_FRAGMENT_CACHE_TIMEOUT', 86400)),
+        'OPTIONS': {'MAX_ENTRIES': 10000} if _fragment_backend.endswith('LocMemCache') else {},
+    },
 }
 
 
@@ -144,6 +228,42 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# In production the ASGI app serves MEDIA_URL itself (core/media.py), with
+# range and conditional request support. Set MEDIA_SENDFILE to "nginx"
+# (X-Accel-Redirect to the internal MEDIA_ACCEL_PREFIX location) or "apache"
+# (X-Sendfile) to hand file bodies to the front-end server instead.
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE', '')
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+# Uploads are stored once per distinct content under blobs/<sha256>, with
+# reference counts in posts.MediaBlob (see core/storage.py)
+STORAGES = {
+    'default': {
+        'BACKEND': 'core.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Post media processing (see posts/media_pipeline.py)
+# Uploaded images get WebP variants no wider than these sizes; videos get a
+# poster frame and duration when ffmpeg/ffprobe are on PATH. Work runs in a
+# pool of MEDIA_PROCESSING_WORKERS processes; 0 processes inline instead.
+MEDIA_VARIANT_SIZES = {'thumb': 320, 'feed': 1080, 'full': 2048}
+MEDIA_VARIANT_QUALITY = 80
+MEDIA_PROCESSING_WORKERS = int(os.environ.get('MEDIA_PROCESSING_WORKERS', 2))
+
+# Resumable chunked uploads (see posts.models.MediaUpload)
+# Chunks are streamed to part files in MEDIA_UPLOAD_TEMP_DIR and moved into
+# MEDIA_ROOT when the post is created.
+MEDIA_UPLOAD_TEMP_DIR = os.environ.get('MEDIA_UPLOAD_TEMP_DIR', str(BASE_DIR / 'upload_tmp'))
+MEDIA_UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+MEDIA_UPLOAD_MAX_SIZE = {
+    'image': 20 * 1024 * 1024,
+    'video': 1024 * 1024 * 1024,
+}
+
 # Login/Logout redirects
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
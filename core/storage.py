@@ -0,0 +1,116 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.apps import apps
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+BLOB_DIR = 'blobs'
+BLOB_NAME_RE = re.compile(rf'^{BLOB_DIR}/[0-9a-f]{{2}}/([0-9a-f]{{64}})(\.[a-z0-9]+)?$')
+BLOB_EXTENSION_RE = re.compile(r'^\.[a-z0-9]+$')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File storage that names files by the SHA-256 of their content.
+
+    Saving content that is already stored returns the existing name, so
+    identical uploads share one file. Each save takes a reference on the
+    blob (posts.MediaBlob) and each delete releases one; the file is removed
+    with its last reference. Files stored before this backend (anything not
+    under ``blobs/``) are deleted as before.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is picked from the content in _save
+        return name
+
+    def _save(self, name, content):
+        extension = self.blob_extension(name)
+        digest = hashlib.sha256()
+        size = 0
+        if hasattr(content, 'temporary_file_path'):
+            # Already on disk (large uploads, chunked part files): hash it in
+            # place and move it only if the content is new
+            source = content.temporary_file_path()
+            with open(source, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+                    size += len(block)
+            temporary = False
+        else:
+            # Stream into a temp file beside the blobs while hashing
+            temp_dir = self.path(os.path.join(BLOB_DIR, 'tmp'))
+            os.makedirs(temp_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=temp_dir, delete=False) as temp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    size += len(chunk)
+                    temp.write(chunk)
+            source = temp.name
+            temporary = True
+
+        blob_name = self.blob_name(digest.hexdigest(), extension)
+        # Take the reference before checking for the file, so a concurrent
+        # release of the last reference can't remove it underneath us
+        self._add_reference(blob_name, size)
+        if self.exists(blob_name):
+            if temporary:
+                os.remove(source)
+        else:
+            os.makedirs(os.path.dirname(self.path(blob_name)), exist_ok=True)
+            file_move_safe(source, self.path(blob_name), allow_overwrite=True)
+        return blob_name
+
+    def delete(self, name):
+        if not name:
+            return
+        if not self.is_blob_name(name):
+            return super().delete(name)
+        MediaBlob = apps.get_model('posts', 'MediaBlob')
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                return
+            if blob.refcount > 1:
+                MediaBlob.objects.filter(name=name).update(refcount=F('refcount') - 1)
+                return
+            blob.delete()
+            super().delete(name)
+
+    @staticmethod
+    def _add_reference(name, size):
+        MediaBlob = apps.get_model('posts', 'MediaBlob')
+        if MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1):
+            return
+        try:
+            with transaction.atomic():
+                MediaBlob.objects.create(name=name, size=size, refcount=1)
+        except IntegrityError:
+            MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+    @staticmethod
+    def blob_extension(name):
+        """The upload's extension if it fits BLOB_NAME_RE, otherwise none, so
+        every stored name is recognised as a blob on delete"""
+        extension = os.path.splitext(name)[1].lower()
+        return extension if BLOB_EXTENSION_RE.match(extension) else ''
+
+    @staticmethod
+    def blob_name(digest, extension=''):
+        return f'{BLOB_DIR}/{digest[:2]}/{digest}{extension}'
+
+    @staticmethod
+    def is_blob_name(name):
+        return BLOB_NAME_RE.match(name) is not None
+
+    @staticmethod
+    def digest_of(name):
+        """SHA-256 hex digest encoded in a blob name, or None"""
+        match = BLOB_NAME_RE.match(name)
+        return match.group(1) if match else None
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.http import HttpResponseNotModified, JsonResponse
+from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+from .media import BLOB_MAX_AGE, etag_matches
+from .storage import ContentAddressedStorage
+
+
+def render_page(request, template, partial, items, has_more, next_cursor, context=None):
+    """Render one page of an infinitely scrolled list. ``items`` is the
+    context of ``partial``, the template for the list entries; AJAX requests
+    get just that rendered and the cursor for the next page, others the
+    full ``template`` with ``items`` and ``context``."""
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({
+            'html': render_to_string(partial, items, request=request),
+            'cursor': next_cursor,
+            'has_more': has_more,
+        })
+
+    context = dict(context or {}, **items, has_more=has_more, next_cursor=next_cursor)
+    return render(request, template, context)
+
+
+def serve_media(request, path):
+    """Serve an uploaded file under runserver with WSGI. Content-addressed
+    blobs get their digest as a strong ETag and an immutable, year-long
+    Cache-Control. The ASGI app serves media itself (see core/media.py)."""
+    digest = ContentAddressedStorage.digest_of(path)
+    if digest is None:
+        return serve(request, path, document_root=settings.MEDIA_ROOT)
+
+    etag = f'"{digest}"'
+    if etag_matches(request.headers.get('If-None-Match', ''), etag):
+        response = HttpResponseNotModified()
+    else:
+        response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=BLOB_MAX_AGE, immutable=True)
+    return response
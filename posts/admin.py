@@ -1,4 +1,5 @@
 from django.contrib import admin
+from core.search import IndexedSearchMixin
 from .models import Post, PostMedia, Comment, Notification
 
 class PostMediaInline(admin.TabularInline):
@@ -6,17 +7,19 @@ class PostMediaInline(admin.TabularInline):
     extra = 1
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ['author', 'description', 'created_at', 'total_likes', 'total_comments']
     list_filter = ['created_at']
-    search_fields = ['description', 'author__username']
+    search_fields = ['description']
+    search_kind = 'post'
     inlines = [PostMediaInline]
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ['author', 'post', 'text', 'created_at']
     list_filter = ['created_at']
-    search_fields = ['text', 'author__username']
+    search_fields = ['text']
+    search_kind = 'comment'
 
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
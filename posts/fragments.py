@@ -0,0 +1,85 @@
+from django.core.cache import caches
+from django.db.models import prefetch_related_objects
+
+# Rendered post card fragments live in their own cache alias so the backend
+# can be swapped (see CACHES['fragments'] in settings). Keys carry the post's
+# updated_at, so edits and media changes switch to a new key instead of
+# deleting old ones. Author details are rendered outside the fragments, so
+# profile saves (every login re-saves the profile) leave them cached.
+FRAGMENT_CACHE_ALIAS = 'fragments'
+STATS_KEYS = {'hit': 'post_fragments_hits', 'miss': 'post_fragments_misses'}
+
+
+def _cache():
+    return caches[FRAGMENT_CACHE_ALIAS]
+
+
+def version(post):
+    """Version string for a post's cached HTML"""
+    return f'{post.updated_at.timestamp():.6f}'
+
+
+def fragment_key(post, name):
+    return f'post_fragment:{name}:{post.pk}:{version(post)}'
+
+
+def load(posts, names):
+    """Fetch the named fragments for a page of posts in one cache round trip.
+
+    Found fragments are attached to each post as ``cached_fragments``, and
+    media is prefetched only for posts that still have a fragment to render.
+    """
+    keys = {(post.pk, name): fragment_key(post, name) for post in posts for name in names}
+    found = _cache().get_many(keys.values())
+    misses = []
+    for post in posts:
+        post.cached_fragments = {
+            name: found[keys[post.pk, name]]
+            for name in names if keys[post.pk, name] in found
+        }
+        if len(post.cached_fragments) < len(names):
+            misses.append(post)
+    if misses:
+        prefetch_related_objects(misses, 'media')
+    record(hits=len(found), misses=len(keys) - len(found))
+    return posts
+
+
+def get_or_render(post, name, render):
+    """Return a post's cached fragment, rendering and storing it on a miss"""
+    cached = getattr(post, 'cached_fragments', None)
+    if cached is None:
+        # Not loaded for this page; look it up on its own
+        html = _cache().get(fragment_key(post, name))
+        record(hits=int(html is not None), misses=int(html is None))
+        if html is not None:
+            return html
+    elif name in cached:
+        return cached[name]
+    html = render()
+    _cache().set(fragment_key(post, name), html)
+    return html
+
+
+def record(hits=0, misses=0):
+    """Add to the shared hit/miss counters"""
+    for kind, count in (('hit', hits), ('miss', misses)):
+        if not count:
+            continue
+        key = STATS_KEYS[kind]
+        cache = _cache()
+        if not cache.add(key, count, timeout=None):
+            try:
+                cache.incr(key, count)
+            except ValueError:
+                cache.set(key, count, timeout=None)
+
+
+def stats():
+    """Return (hits, misses) counted since the last reset"""
+    values = _cache().get_many(STATS_KEYS.values())
+    return values.get(STATS_KEYS['hit'], 0), values.get(STATS_KEYS['miss'], 0)
+
+
+def reset_stats():
+    _cache().delete_many(STATS_KEYS.values())
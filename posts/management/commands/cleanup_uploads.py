@@ -0,0 +1,18 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from posts.models import MediaUpload
+
+
+class Command(BaseCommand):
+    help = 'Delete chunked uploads that were never attached to a post'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24,
+                            help='Age after which an unattached upload is abandoned')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        # Deleting through the ORM fires post_delete, which removes part files
+        deleted, _ = MediaUpload.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Removed {deleted} abandoned uploads'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from posts import fragments
+
+
+class Command(BaseCommand):
+    help = 'Show hit/miss counts for the post card fragment cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing')
+
+    def handle(self, *args, **options):
+        hits, misses = fragments.stats()
+        total = hits + misses
+        ratio = f'{hits / total:.1%}' if total else 'n/a'
+        self.stdout.write(f'hits: {hits}  misses: {misses}  hit ratio: {ratio}')
+        if options['reset']:
+            fragments.reset_stats()
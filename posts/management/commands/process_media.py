@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from posts.media_pipeline import process_media
+from posts.models import PostMedia
+
+
+class Command(BaseCommand):
+    help = 'Generate variants for post media still waiting to be processed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Also retry media that failed to process')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            PostMedia.objects.filter(status='failed').update(status='pending')
+        media_ids = list(PostMedia.objects.filter(status='pending').order_by('id').values_list('id', flat=True))
+        for media_id in media_ids:
+            process_media(media_id)
+        ready = PostMedia.objects.filter(id__in=media_ids, status='ready').count()
+        self.stdout.write(self.style.SUCCESS(f'Processed {ready} of {len(media_ids)} media files'))
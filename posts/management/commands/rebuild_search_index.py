@@ -0,0 +1,36 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core import search
+from posts.models import Comment, Post, SearchDocument
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from posts, comments and users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Objects indexed per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        SearchDocument.objects.all().delete()
+        sources = [
+            ('post', Post.objects.only('description'), lambda post: post.description),
+            ('comment', Comment.objects.only('text'), lambda comment: comment.text),
+            ('user', User.objects.select_related('profile'), lambda user: user.profile.search_text()),
+        ]
+        for kind, queryset, text in sources:
+            last_id = 0
+            total = 0
+            while True:
+                batch = list(queryset.filter(id__gt=last_id).order_by('id')[:batch_size])
+                if not batch:
+                    break
+                with transaction.atomic():
+                    for obj in batch:
+                        search.index(kind, obj.pk, text(obj))
+                total += len(batch)
+                last_id = batch[-1].pk
+            self.stdout.write(f'Indexed {total} {kind}s')
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized like and comment counts on posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Posts updated per statement')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        total = 0
+        while True:
+            ids = list(
+                Post.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            total += Post.reconcile_counters(Post.objects.filter(id__in=ids))
+            last_id = ids[-1]
+        self.stdout.write(self.style.SUCCESS(f'Reconciled counters on {total} posts'))
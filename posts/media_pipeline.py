@@ -0,0 +1,188 @@
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Post media is processed after the upload request has returned: images are
+# resized into WebP variants, videos get a poster frame and duration, and
+# metadata (EXIF/GPS, container tags) is stripped from the stored original.
+# Jobs go to a process pool so Pillow and ffmpeg work never holds a web
+# worker or the GIL. Rows stay 'pending' until done; `manage.py
+# process_media` picks up anything left behind by a restart.
+
+# Encoder options used when re-saving an original to drop its metadata
+STRIP_SAVE_OPTIONS = {
+    'JPEG': {'quality': 95},
+    'WEBP': {'quality': 95},
+}
+
+_pool = None
+
+
+def _init_worker():
+    import django
+    django.setup()
+    # Don't share the parent's database connections
+    from django.db import connections
+    connections.close_all()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.MEDIA_PROCESSING_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+        )
+    return _pool
+
+
+def enqueue(media_ids):
+    """Process the given PostMedia rows once the current transaction commits"""
+    media_ids = list(media_ids)
+    if media_ids:
+        transaction.on_commit(lambda: _submit(media_ids))
+
+
+def _submit(media_ids):
+    for media_id in media_ids:
+        if settings.MEDIA_PROCESSING_WORKERS <= 0:
+            process_media(media_id)
+        else:
+            _get_pool().submit(process_media, media_id).add_done_callback(_log_failure)
+
+
+def _log_failure(future):
+    if future.exception():
+        logger.error('Media processing crashed', exc_info=future.exception())
+
+
+def process_media(media_id):
+    """Generate variants for one PostMedia row and record them on it"""
+    from .models import PostMedia
+
+    media = PostMedia.objects.filter(pk=media_id).first()
+    if media is None or media.status != 'pending':
+        return
+    try:
+        if media.media_type == 'image':
+            fields = _process_image(media)
+        else:
+            fields = _process_video(media)
+        fields['status'] = 'ready'
+    except Exception:
+        logger.exception('Could not process media %s', media_id)
+        fields = {'status': 'failed'}
+    # save() rather than update() so the post's cached card is refreshed
+    for name, value in fields.items():
+        setattr(media, name, value)
+    media.save(update_fields=list(fields))
+
+
+def _save_variant(media, name, extension, content):
+    return media.file.storage.save(f'post_media/variants/{media.pk}/{name}.{extension}', ContentFile(content))
+
+
+def _process_image(media):
+    from PIL import Image, ImageOps
+
+    with media.file.open('rb') as source:
+        image = Image.open(source)
+        image.load()
+    original_format = image.format
+    image = ImageOps.exif_transpose(image)
+    width, height = image.size
+
+    variants = {}
+    for name, size in settings.MEDIA_VARIANT_SIZES.items():
+        variant = image.copy()
+        variant.thumbnail((size, size))
+        if variant.mode not in ('RGB', 'RGBA'):
+            has_alpha = variant.mode in ('LA', 'PA') or 'transparency' in variant.info
+            variant = variant.convert('RGBA' if has_alpha else 'RGB')
+        out = BytesIO()
+        # Pillow only writes EXIF/XMP when asked to, so variants carry none
+        variant.save(out, 'WEBP', quality=settings.MEDIA_VARIANT_QUALITY, method=4)
+        variants[name] = _save_variant(media, name, 'webp', out.getvalue())
+
+    fields = {'width': width, 'height': height, 'variants': variants}
+    if image.getexif() or 'xmp' in image.info:
+        # Rewrite the stored original without EXIF/XMP
+        image.info.pop('exif', None)
+        image.info.pop('xmp', None)
+        out = BytesIO()
+        image.save(out, original_format, **STRIP_SAVE_OPTIONS.get(original_format, {}))
+        fields.update(_replace_original(media, ContentFile(out.getvalue())))
+    return fields
+
+
+def _replace_original(media, content):
+    """Store a cleaned copy of the original and release the old file,
+    returning the field update if the name changed (it will, for
+    content-addressed storage)"""
+    storage = media.file.storage
+    name = media.file.name
+    saved = storage.save(name, content)
+    if saved == name:
+        return {}
+    storage.delete(name)
+    return {'file': saved}
+
+
+def _process_video(media):
+    ffmpeg = shutil.which('ffmpeg')
+    ffprobe = shutil.which('ffprobe')
+    if not ffmpeg or not ffprobe:
+        logger.warning('ffmpeg/ffprobe not found; storing video %s as uploaded', media.pk)
+        return {}
+
+    fields = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, 'source')
+        with media.file.open('rb') as upload, open(source, 'wb') as local:
+            shutil.copyfileobj(upload, local)
+
+        probe = subprocess.run(
+            [ffprobe, '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'stream=width,height:format=duration', '-of', 'json', source],
+            capture_output=True, check=True, text=True,
+        )
+        info = json.loads(probe.stdout)
+        stream = (info.get('streams') or [{}])[0]
+        fields['width'] = stream.get('width')
+        fields['height'] = stream.get('height')
+        duration = info.get('format', {}).get('duration')
+        fields['duration'] = float(duration) if duration else None
+
+        poster = os.path.join(workdir, 'poster.webp')
+        seek = min(1.0, (fields['duration'] or 0) / 2)
+        subprocess.run(
+            [ffmpeg, '-v', 'error', '-ss', str(seek), '-i', source, '-frames:v', '1',
+             '-vf', f"scale='min({settings.MEDIA_VARIANT_SIZES['feed']},iw)':-2", poster],
+            check=True,
+        )
+        with open(poster, 'rb') as frame:
+            fields['variants'] = {'poster': _save_variant(media, 'poster', 'webp', frame.read())}
+
+        # Drop container metadata (location, device, creation tags) without re-encoding
+        stripped = os.path.join(workdir, 'stripped' + os.path.splitext(media.file.name)[1])
+        subprocess.run(
+            [ffmpeg, '-v', 'error', '-i', source, '-map', '0', '-map_metadata', '-1',
+             '-c', 'copy', '-y', stripped],
+            check=True,
+        )
+        with open(stripped, 'rb') as clean:
+            fields.update(_replace_original(media, File(clean)))
+    return fields
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:37
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+FANOUT_FOLLOWER_LIMIT = 5000
+
+
+def build_timelines(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    TimelineEntry = apps.get_model('posts', 'TimelineEntry')
+    UserProfile = apps.get_model('userapp', 'UserProfile')
+
+    follower_ids = defaultdict(list)
+    for author_id, follower_id in UserProfile.followers.through.objects.values_list('userprofile__user_id', 'user_id'):
+        follower_ids[author_id].append(follower_id)
+    popular = [author_id for author_id, ids in follower_ids.items() if len(ids) > FANOUT_FOLLOWER_LIMIT]
+    Post.objects.exclude(author_id__in=popular).update(fanned_out=True)
+
+    entries = []
+    for post_id, author_id, created_at, fanned_out in Post.objects.values_list('id', 'author_id', 'created_at', 'fanned_out'):
+        recipients = [author_id] + (follower_ids[author_id] if fanned_out else [])
+        entries.extend(
+            TimelineEntry(user_id=user_id, post_id=post_id, created_at=created_at)
+            for user_id in recipients
+        )
+        if len(entries) >= 5000:
+            TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+            entries = []
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0002_notification'),
+        ('userapp', '0002_friendship'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='fanned_out',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='posts.post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-created_at', '-post'], name='posts_timeline_user_idx')],
+                'unique_together': {('user', 'post')},
+            },
+        ),
+        migrations.RunPython(build_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def dedupe_friend_notifications(apps, schema_editor):
+    Notification = apps.get_model('posts', 'Notification')
+    keep = (
+        Notification.objects.filter(notification_type='friend')
+        .values('recipient_id', 'sender_id').annotate(first_id=Min('id'))
+        .values_list('first_id', flat=True)
+    )
+    Notification.objects.filter(notification_type='friend').exclude(id__in=list(keep)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_mediablob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='actor_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='previous_sender',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='comment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='posts.comment'),
+        ),
+        migrations.RunPython(dedupe_friend_notifications, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('notification_type', 'friend')), fields=('recipient', 'sender', 'notification_type'), name='unique_friend_notification'),
+        ),
+    ]
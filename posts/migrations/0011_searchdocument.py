@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+SQLITE_INDEX = [
+    """CREATE VIRTUAL TABLE posts_searchdocument_fts USING fts5(
+        body, content='posts_searchdocument', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER posts_searchdocument_ai AFTER INSERT ON posts_searchdocument BEGIN
+        INSERT INTO posts_searchdocument_fts(rowid, body) VALUES (new.id, new.body);
+    END""",
+    """CREATE TRIGGER posts_searchdocument_ad AFTER DELETE ON posts_searchdocument BEGIN
+        INSERT INTO posts_searchdocument_fts(posts_searchdocument_fts, rowid, body) VALUES ('delete', old.id, old.body);
+    END""",
+    """CREATE TRIGGER posts_searchdocument_au AFTER UPDATE OF body ON posts_searchdocument BEGIN
+        INSERT INTO posts_searchdocument_fts(posts_searchdocument_fts, rowid, body) VALUES ('delete', old.id, old.body);
+        INSERT INTO posts_searchdocument_fts(rowid, body) VALUES (new.id, new.body);
+    END""",
+]
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS posts_searchdocument_au',
+    'DROP TRIGGER IF EXISTS posts_searchdocument_ad',
+    'DROP TRIGGER IF EXISTS posts_searchdocument_ai',
+    'DROP TABLE IF EXISTS posts_searchdocument_fts',
+]
+POSTGRES_INDEX = [
+    """ALTER TABLE posts_searchdocument ADD COLUMN vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('simple', body)) STORED""",
+    'CREATE INDEX posts_searchdocument_vector_idx ON posts_searchdocument USING GIN (vector)',
+]
+POSTGRES_DROP = [
+    'DROP INDEX IF EXISTS posts_searchdocument_vector_idx',
+    'ALTER TABLE posts_searchdocument DROP COLUMN IF EXISTS vector',
+]
+# Existing content, indexed once the index is in place
+BACKFILL = [
+    """INSERT INTO posts_searchdocument (kind, object_id, body, updated_at)
+        SELECT 'post', id, description, CURRENT_TIMESTAMP FROM posts_post WHERE description <> ''""",
+    """INSERT INTO posts_searchdocument (kind, object_id, body, updated_at)
+        SELECT 'comment', id, text, CURRENT_TIMESTAMP FROM posts_comment WHERE text <> ''""",
+    """INSERT INTO posts_searchdocument (kind, object_id, body, updated_at)
+        SELECT 'user', u.id, u.username || ' ' || u.first_name || ' ' || u.last_name || ' ' || p.bio, CURRENT_TIMESTAMP
+        FROM auth_user u JOIN userapp_userprofile p ON p.user_id = u.id""",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+create_index = run({'sqlite': SQLITE_INDEX + BACKFILL, 'postgresql': POSTGRES_INDEX + BACKFILL})
+drop_index = run({'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_notification_indexes'),
+        ('userapp', '0002_friendship'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('body', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='posts_search_document_unique')],
+            },
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_actors(apps, schema_editor):
+    # Only the shown actors are known for existing rows; their count is
+    # kept as recorded
+    Notification = apps.get_model('posts', 'Notification')
+    Actor = Notification.actors.through
+    rows = Notification.objects.exclude(notification_type='friend').values_list('id', 'sender_id', 'previous_sender_id')
+    Actor.objects.bulk_create([
+        Actor(notification_id=pk, user_id=user_id)
+        for pk, sender_id, previous_sender_id in rows.iterator()
+        for user_id in {sender_id, previous_sender_id} if user_id
+    ], batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_searchdocument'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='actors',
+            field=models.ManyToManyField(blank=True, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_actors, migrations.RunPython.noop),
+    ]
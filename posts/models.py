@@ -1,6 +1,41 @@
-from django.db import models
+import hashlib
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.db import connection, models, transaction
 from django.contrib.auth.models import User
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from chat.models import push_unread_update
+from core import search
+from userapp.models import UserProfile
+
+# Authors with more followers than this are merged into timelines at read
+# time rather than copied to every follower
+FANOUT_FOLLOWER_LIMIT = 5000
+FANOUT_BATCH_SIZE = 1000
+# Entries kept per home timeline
+TIMELINE_MAX_LENGTH = 800
+# Posts copied into a timeline when its owner follows someone
+FOLLOW_BACKFILL_SIZE = 50
+# Trims timelines after fan-out so posting doesn't wait on them
+_timeline_trimmer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='timeline-trim')
+# Seconds a cached unread notification count is trusted
+UNREAD_COUNT_TIMEOUT = 300
+
+def older_than(position, id_field='id'):
+    """Q for rows strictly before a (created_at, id) keyset position in
+    newest-first order"""
+    created_at, pk = position
+    return Q(created_at__lt=created_at) | Q(created_at=created_at, **{f'{id_field}__lt': pk})
 
 class Post(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
@@ -8,9 +43,19 @@ class Post(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     likes = models.ManyToManyField(User, related_name='liked_posts', blank=True)
+    # False for posts by high-follower authors, which are merged into
+    # timelines at read time instead of being copied to every follower
+    fanned_out = models.BooleanField(default=False)
+    # Denormalized counts, kept in step with F() updates wherever likes and
+    # comments change; `manage.py reconcile_post_counters` repairs drift
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['author', '-created_at', '-id'], name='posts_post_author_idx'),
+        ]
 
     def __str__(self):
         return f"{self.author.username} - {self.description[:50]}"
@@ -18,13 +63,102 @@ class Post(models.Model):
     def get_absolute_url(self):
         return reverse('post_detail', kwargs={'pk': self.pk})
 
+    @property
+    def cursor(self):
+        """Keyset position of this post, for loading the ones after it"""
+        return f"{self.created_at.isoformat()}|{self.id}"
+
+    @staticmethod
+    def parse_cursor(cursor):
+        """Return (created_at, id) from a cursor string, or None if invalid"""
+        try:
+            created_at, pk = cursor.rsplit('|', 1)
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (AttributeError, ValueError):
+            return None
+        return (created_at, pk) if created_at else None
+
+    @staticmethod
+    def page_for_author(author, before=None, limit=20):
+        """Return up to ``limit`` of an author's posts older than the
+        ``before`` cursor, newest first, and whether more remain"""
+        posts = Post.objects.filter(author=author)
+        position = Post.parse_cursor(before) if before else None
+        if position:
+            posts = posts.filter(older_than(position))
+        posts = list(
+            posts.order_by('-created_at', '-id')
+            .select_related('author', 'author__profile')
+            .prefetch_related('media')[:limit + 1]
+        )
+        return posts[:limit], len(posts) > limit
+
     @property
     def total_likes(self):
-        return self.likes.count()
+        return self.like_count
+
+    def is_liked_by(self, user):
+        return Post.likes.through.objects.filter(post_id=self.pk, user_id=user.pk).exists()
+
+    @staticmethod
+    def mark_liked_by(posts, user):
+        """Set ``viewer_liked`` on each post with one query for the whole page"""
+        liked = set(
+            Post.likes.through.objects
+            .filter(user_id=user.pk, post_id__in=[post.pk for post in posts])
+            .values_list('post_id', flat=True)
+        )
+        for post in posts:
+            post.viewer_liked = post.pk in liked
+        return posts
 
     @property
     def total_comments(self):
-        return self.comments.count()
+        return self.comment_count
+
+    @staticmethod
+    def reconcile_counters(queryset=None):
+        """Recompute like_count and comment_count from the like and comment
+        rows; returns the number of posts updated"""
+        likes = (
+            Post.likes.through.objects.filter(post_id=OuterRef('pk'))
+            .values('post_id').annotate(total=Count('*')).values('total')
+        )
+        comments = (
+            Comment.objects.filter(post_id=OuterRef('pk'))
+            .values('post_id').annotate(total=Count('*')).values('total')
+        )
+        queryset = Post.objects.all() if queryset is None else queryset
+        return queryset.update(
+            like_count=Coalesce(Subquery(likes), 0),
+            comment_count=Coalesce(Subquery(comments), 0),
+        )
+
+class MediaBlob(models.Model):
+    """Reference count for a content-addressed file (see core/storage.py)"""
+    name = models.CharField(max_length=255, primary_key=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
+
+class SearchDocument(models.Model):
+    """Text of one searchable object, full-text indexed (see core/search.py)"""
+    kind = models.CharField(max_length=20)
+    object_id = models.PositiveBigIntegerField()
+    body = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='posts_search_document_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
 
 class PostMedia(models.Model):
     MEDIA_TYPE_CHOICES = [
@@ -32,14 +166,171 @@ class PostMedia(models.Model):
         ('video', 'Video'),
     ]
     
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+    IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp']
+    VIDEO_EXTENSIONS = ['mp4', 'avi', 'mov', 'wmv', 'webm']
+
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='media')
     file = models.FileField(upload_to='post_media/')
     media_type = models.CharField(max_length=10, choices=MEDIA_TYPE_CHOICES)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # Filled in by posts/media_pipeline.py after upload
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    # Storage names of generated files: thumb/feed/full WebP images, or poster
+    variants = models.JSONField(default=dict, blank=True)
 
     def __str__(self):
         return f"{self.post.author.username}'s {self.media_type}"
 
+    @staticmethod
+    def detect_media_type(name, content_type=''):
+        """Classify an upload as 'image' or 'video' from its declared content
+        type, falling back to the extension. The pipeline checks the actual
+        content later and marks unreadable files as failed."""
+        content_type = (content_type or '').split('/')[0]
+        if content_type in ('image', 'video'):
+            return content_type
+        extension = name.rsplit('.', 1)[-1].lower()
+        if extension in PostMedia.IMAGE_EXTENSIONS:
+            return 'image'
+        if extension in PostMedia.VIDEO_EXTENSIONS:
+            return 'video'
+        return None
+
+    def variant_url(self, name):
+        """URL of a generated variant, or the original until it exists"""
+        variant = self.variants.get(name)
+        return self.file.storage.url(variant) if variant else self.file.url
+
+    @property
+    def thumb_url(self):
+        return self.variant_url('thumb')
+
+    @property
+    def feed_url(self):
+        return self.variant_url('feed')
+
+    @property
+    def full_url(self):
+        return self.variant_url('full')
+
+    @property
+    def poster_url(self):
+        poster = self.variants.get('poster')
+        return self.file.storage.url(poster) if poster else ''
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class _PartFile(File):
+    """A finished part file. Exposing its path lets FileSystemStorage move it
+    into place instead of copying it."""
+    def temporary_file_path(self):
+        return self.file.name
+
+class MediaUpload(models.Model):
+    """A resumable upload. Chunks are appended in order to a part file under
+    MEDIA_UPLOAD_TEMP_DIR; a finalized upload is attached to a PostMedia
+    when the post is created."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='media_uploads')
+    filename = models.CharField(max_length=255)
+    media_type = models.CharField(max_length=10, choices=PostMedia.MEDIA_TYPE_CHOICES)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)
+    completed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user.username}'s upload of {self.filename}"
+
+    @property
+    def part_path(self):
+        return os.path.join(settings.MEDIA_UPLOAD_TEMP_DIR, f'{self.pk}.part')
+
+    @staticmethod
+    def start(user, filename, size, content_type=''):
+        filename = os.path.basename(filename or '')
+        media_type = PostMedia.detect_media_type(filename, content_type)
+        if not filename or media_type is None:
+            raise UploadError('Unsupported file type')
+        if size <= 0:
+            raise UploadError('Empty file')
+        if size > settings.MEDIA_UPLOAD_MAX_SIZE[media_type]:
+            raise UploadError('File is too large', status=413)
+        return MediaUpload.objects.create(user=user, filename=filename, media_type=media_type, size=size)
+
+    def append(self, stream, offset, length, checksum=None):
+        """Write ``length`` bytes from ``stream`` at ``offset``, reading in
+        small blocks. The caller should hold a row lock. If ``checksum`` (a
+        SHA-256 hex digest of the chunk) doesn't match, the chunk is
+        discarded and the offset stays where it was."""
+        if self.completed:
+            raise UploadError('Upload already finalized', status=409)
+        if offset != self.received:
+            raise UploadError(f'Expected offset {self.received}', status=409)
+        if length <= 0 or length > settings.MEDIA_UPLOAD_CHUNK_SIZE:
+            raise UploadError('Invalid chunk size', status=413)
+        if offset + length > self.size:
+            raise UploadError('Chunk runs past the declared size', status=413)
+
+        os.makedirs(settings.MEDIA_UPLOAD_TEMP_DIR, exist_ok=True)
+        digest = hashlib.sha256()
+        with open(self.part_path, 'r+b' if offset else 'wb') as part:
+            # Drop anything left over from an interrupted chunk
+            part.seek(offset)
+            part.truncate()
+            remaining = length
+            while remaining:
+                block = stream.read(min(remaining, 64 * 1024))
+                if not block:
+                    break
+                digest.update(block)
+                part.write(block)
+                remaining -= len(block)
+            if remaining or (checksum and digest.hexdigest() != checksum.lower()):
+                part.seek(offset)
+                part.truncate()
+                raise UploadError('Chunk was incomplete or corrupted')
+
+        self.received = offset + length
+        self.save(update_fields=['received'])
+
+    def finalize(self, checksum=None):
+        """Check the whole file against ``checksum`` and mark it complete"""
+        if self.received != self.size:
+            raise UploadError(f'Received {self.received} of {self.size} bytes', status=409)
+        digest = hashlib.sha256()
+        with open(self.part_path, 'rb') as part:
+            for block in iter(lambda: part.read(1024 * 1024), b''):
+                digest.update(block)
+        if checksum and digest.hexdigest() != checksum.lower():
+            raise UploadError('Checksum mismatch')
+        self.sha256 = digest.hexdigest()
+        self.completed = True
+        self.save(update_fields=['sha256', 'completed'])
+
+    def attach_to(self, post):
+        """Move the finished file into media storage as a PostMedia"""
+        with open(self.part_path, 'rb') as part:
+            media = PostMedia.objects.create(
+                post=post,
+                file=_PartFile(part, name=self.filename),
+                media_type=self.media_type,
+            )
+        self.delete()
+        return media
+
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
@@ -52,6 +343,112 @@ class Comment(models.Model):
     def __str__(self):
         return f"{self.author.username} on {self.post}"
 
+class TimelineEntry(models.Model):
+    """A post in a user's home timeline.
+
+    Posts are copied into the author's and followers' timelines when
+    created (fan-out on write), so reading a feed is one range read over
+    ``(user, created_at)``. Authors with more than FANOUT_FOLLOWER_LIMIT
+    followers are skipped and their posts merged in at read time instead.
+    Timelines are trimmed to TIMELINE_MAX_LENGTH entries in the background
+    after each fan-out.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    # Copy of post.created_at so the timeline can be read in order without a join
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='posts_timeline_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}: post {self.post_id}"
+
+    @staticmethod
+    def fan_out(post):
+        """Copy a new post into its author's and followers' timelines"""
+        follower_ids = list(
+            post.author.profile.followers.values_list('id', flat=True)[:FANOUT_FOLLOWER_LIMIT + 1]
+        )
+        recipient_ids = [post.author_id]
+        if len(follower_ids) <= FANOUT_FOLLOWER_LIMIT:
+            recipient_ids += follower_ids
+            Post.objects.filter(pk=post.pk).update(fanned_out=True)
+            post.fanned_out = True
+        TimelineEntry.objects.bulk_create([
+            TimelineEntry(user_id=user_id, post=post, created_at=post.created_at)
+            for user_id in recipient_ids
+        ], batch_size=FANOUT_BATCH_SIZE, ignore_conflicts=True)
+        TimelineEntry.trim_later(recipient_ids)
+
+    @staticmethod
+    def backfill(user_id, author_id):
+        """Add an author's recent fanned-out posts after user_id follows them"""
+        posts = Post.objects.filter(author_id=author_id, fanned_out=True).values_list('id', 'created_at')
+        TimelineEntry.objects.bulk_create([
+            TimelineEntry(user_id=user_id, post_id=post_id, created_at=created_at)
+            for post_id, created_at in posts[:FOLLOW_BACKFILL_SIZE]
+        ], ignore_conflicts=True)
+        TimelineEntry.trim([user_id])
+
+    @staticmethod
+    def trim(user_ids):
+        """Drop entries beyond TIMELINE_MAX_LENGTH from the given timelines.
+
+        The first entry past the cap is looked up per timeline through
+        posts_timeline_user_idx, and only timelines that have one are
+        deleted from."""
+        user_ids = list(user_ids)
+        first_dropped = TimelineEntry.objects.filter(user_id=OuterRef('pk')).order_by(
+            '-created_at', '-post_id',
+        )[TIMELINE_MAX_LENGTH:TIMELINE_MAX_LENGTH + 1]
+        for start in range(0, len(user_ids), FANOUT_BATCH_SIZE):
+            over_cap = User.objects.filter(pk__in=user_ids[start:start + FANOUT_BATCH_SIZE]).annotate(
+                cutoff_at=Subquery(first_dropped.values('created_at')),
+                cutoff_post=Subquery(first_dropped.values('post_id')),
+            ).filter(cutoff_at__isnull=False).values_list('pk', 'cutoff_at', 'cutoff_post')
+            for user_id, created_at, post_id in over_cap:
+                TimelineEntry.objects.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, post_id__lte=post_id),
+                    user_id=user_id,
+                ).delete()
+
+    @staticmethod
+    def trim_later(user_ids):
+        """Trim the given timelines in the background once the current
+        transaction commits"""
+        user_ids = list(user_ids)
+        transaction.on_commit(lambda: _timeline_trimmer.submit(TimelineEntry._trim_in_worker, user_ids))
+
+    @staticmethod
+    def _trim_in_worker(user_ids):
+        try:
+            TimelineEntry.trim(user_ids)
+        finally:
+            # Runs in a worker thread that Django doesn't clean up after
+            connection.close()
+
+    @staticmethod
+    def post_ids_for(user, limit, before=None):
+        """Return the ids of up to ``limit`` posts in the user's home
+        timeline older than the ``before`` cursor, newest first, and whether
+        more remain"""
+        entries = TimelineEntry.objects.filter(user=user)
+        # Fan-out on read for authors too popular to fan out on write
+        pulled = Post.objects.filter(author__profile__followers=user, fanned_out=False)
+        position = Post.parse_cursor(before) if before else None
+        if position:
+            entries = entries.filter(older_than(position, id_field='post_id'))
+            pulled = pulled.filter(older_than(position))
+
+        entries = entries.order_by('-created_at', '-post_id').values_list('created_at', 'post_id')
+        pulled = pulled.order_by('-created_at', '-id').values_list('created_at', 'id')
+        merged = sorted(set(entries[:limit + 1]) | set(pulled[:limit + 1]), reverse=True)
+        return [post_id for _, post_id in merged[:limit]], len(merged) > limit
+
 class Notification(models.Model):
     NOTIFICATION_TYPES = [
         ('follow', 'Follow'),
@@ -61,26 +458,157 @@ class Notification(models.Model):
     ]
     
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    # Most recent actor. Likes, comments and follows within a window are
+    # rolled into one row (see posts/notifications.py); previous_sender is
+    # the actor before it, actors everyone the row holds and actor_count
+    # their number, kept for display.
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_notifications')
+    previous_sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    actors = models.ManyToManyField(User, related_name='+', blank=True)
+    actor_count = models.PositiveIntegerField(default=1)
     notification_type = models.CharField(max_length=10, choices=NOTIFICATION_TYPES)
     post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, blank=True, related_name='notifications')
-    comment = models.ForeignKey(Comment, on_delete=models.CASCADE, null=True, blank=True)
+    comment = models.ForeignKey(Comment, on_delete=models.SET_NULL, null=True, blank=True)
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['recipient', 'is_read', 'created_at'], name='posts_notif_unread_idx'),
+            models.Index(fields=['recipient', '-created_at', '-id'], name='posts_notif_inbox_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipient', 'sender', 'notification_type'],
+                condition=Q(notification_type='friend'),
+                name='unique_friend_notification',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.sender.username} {self.notification_type} - {self.recipient.username}"
     
+    @property
+    def cursor(self):
+        return f"{self.created_at.isoformat()}|{self.id}"
+    
+    parse_cursor = staticmethod(Post.parse_cursor)
+    
+    @staticmethod
+    def inbox(user, before=None, limit=20):
+        """Return up to ``limit`` of a user's notifications older than the
+        ``before`` cursor, newest first, and whether more remain"""
+        notifications = Notification.objects.filter(recipient=user)
+        position = Notification.parse_cursor(before) if before else None
+        if position:
+            notifications = notifications.filter(older_than(position))
+        notifications = list(
+            notifications.order_by('-created_at', '-id')
+            .select_related('sender', 'sender__profile', 'previous_sender', 'post', 'comment')[:limit + 1]
+        )
+        return notifications[:limit], len(notifications) > limit
+    
+    @staticmethod
+    def unread_cache_key(user_id):
+        return f'notifications_unread_{user_id}'
+    
+    @staticmethod
+    def unread_count(user_id, fresh=False):
+        """Unread notifications for the navbar badge, cached in the shared
+        cache until they change. ``fresh`` recounts with the indexed COUNT
+        and refreshes the cache, for pushes that follow a change."""
+        key = Notification.unread_cache_key(user_id)
+        count = None if fresh else cache.get(key)
+        if count is None:
+            count = Notification.objects.filter(recipient_id=user_id, is_read=False).count()
+            cache.set(key, count, UNREAD_COUNT_TIMEOUT)
+        return count
+    
+    @staticmethod
+    def unread_changed(user_id):
+        """Drop the cached count and push fresh counts to the user's sockets"""
+        cache.delete(Notification.unread_cache_key(user_id))
+        push_unread_update(user_id)
+    
+    def actors_display(self):
+        """'A', 'A and B', or 'A, B and 98 others'"""
+        names = [self.sender.get_full_name()]
+        if self.previous_sender_id:
+            names.append(self.previous_sender.get_full_name())
+        others = self.actor_count - len(names)
+        if others > 0:
+            return f"{', '.join(names)} and {others} other{'s' if others > 1 else ''}"
+        return ' and '.join(names)
+    
     def get_message(self):
         if self.notification_type == 'follow':
-            return f"{self.sender.get_full_name()} started following you"
+            return f"{self.actors_display()} started following you"
         elif self.notification_type == 'like':
-            return f"{self.sender.get_full_name()} liked your post"
+            return f"{self.actors_display()} liked your post"
         elif self.notification_type == 'comment':
-            return f"{self.sender.get_full_name()} commented on your post"
+            return f"{self.actors_display()} commented on your post"
         elif self.notification_type == 'friend':
             return f"You and {self.sender.get_full_name()} are now friends"
         return ""
+
+# Keep the recipient's navbar badge current without polling
+@receiver(post_save, sender=Notification)
+@receiver(post_delete, sender=Notification)
+def push_notification_count(sender, instance, **kwargs):
+    Notification.unread_changed(instance.recipient_id)
+
+# Keep home timelines in step with follows
+@receiver(m2m_changed, sender=UserProfile.followers.through)
+def sync_timelines(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove'):
+        return
+    if not reverse:
+        pairs = [(follower_id, instance.user_id) for follower_id in pk_set]
+    else:
+        author_ids = model.objects.filter(pk__in=pk_set).values_list('user_id', flat=True)
+        pairs = [(instance.pk, author_id) for author_id in author_ids]
+    for user_id, author_id in pairs:
+        if action == 'post_add':
+            TimelineEntry.backfill(user_id, author_id)
+        else:
+            TimelineEntry.objects.filter(user_id=user_id, post__author_id=author_id).delete()
+
+# Release a deleted media row's file and variants (also on Post delete cascade)
+@receiver(post_delete, sender=PostMedia)
+def release_media_files(sender, instance, **kwargs):
+    storage = instance.file.storage
+    names = [name for name in (instance.file.name, *instance.variants.values()) if name]
+
+    def release():
+        for name in names:
+            storage.delete(name)
+    transaction.on_commit(release)
+
+# Media changes move the post to a new card fragment key (see posts/fragments.py)
+@receiver(post_save, sender=PostMedia)
+@receiver(post_delete, sender=PostMedia)
+def touch_post_on_media_change(sender, instance, **kwargs):
+    Post.objects.filter(pk=instance.post_id).update(updated_at=timezone.now())
+
+# Remove part files of uploads that are attached, abandoned or deleted
+@receiver(post_delete, sender=MediaUpload)
+def remove_upload_part(sender, instance, **kwargs):
+    try:
+        os.remove(instance.part_path)
+    except FileNotFoundError:
+        pass
+
+# Keep the full-text index current
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    search.index('post', instance.pk, instance.description)
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, **kwargs):
+    search.index('comment', instance.pk, instance.text)
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Comment)
+def unindex_post_or_comment(sender, instance, **kwargs):
+    search.unindex(sender._meta.model_name, instance.pk)
@@ -0,0 +1,192 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+from .models import Comment, Notification
+
+# Likes, comments and follows for the same (recipient, type, post) are
+# rolled into one unread row while it is younger than AGGREGATION_WINDOW:
+# "A, B and 98 others liked your post". Once read, the next event starts a
+# new row. Friend notifications stay one row per pair.
+AGGREGATED_TYPES = ('like', 'comment', 'follow')
+AGGREGATION_WINDOW = timedelta(hours=24)
+
+# Inbox pages mark what they showed as read from this background thread,
+# after the response has been handed back
+_read_marker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='notifications-read')
+
+
+def _open_rows(recipient_id, notification_type, post_id):
+    return Notification.objects.filter(
+        recipient_id=recipient_id,
+        notification_type=notification_type,
+        post_id=post_id,
+        is_read=False,
+        created_at__gte=timezone.now() - AGGREGATION_WINDOW,
+    )
+
+
+def notify(recipient, actor, notification_type, post=None, comment=None):
+    """Record that ``actor`` liked/commented/followed, folding it into the
+    recipient's open row for the same post and type when there is one"""
+    if recipient.pk == actor.pk:
+        return
+    post_id = post.pk if post else None
+    with transaction.atomic():
+        row = None
+        if notification_type in AGGREGATED_TYPES:
+            row = (
+                _open_rows(recipient.pk, notification_type, post_id)
+                .select_for_update().order_by('-created_at').first()
+            )
+        if row is None:
+            row = Notification.objects.create(
+                recipient=recipient,
+                sender=actor,
+                notification_type=notification_type,
+                post=post,
+                comment=comment,
+            )
+            if notification_type in AGGREGATED_TYPES:
+                row.actors.add(actor)
+            publish(recipient.pk, row.pk)
+            return
+
+        # The newest actor is shown first; the one it displaces moves to
+        # previous_sender. Only actors new to the row are counted, so
+        # repeat likes, follows or comments by one actor count once.
+        changes = {'sender_id': actor.pk, 'created_at': timezone.now()}
+        _, joined = Notification.actors.through.objects.get_or_create(notification_id=row.pk, user_id=actor.pk)
+        if joined:
+            changes['actor_count'] = F('actor_count') + 1
+        if comment is not None:
+            changes['comment_id'] = comment.pk
+        if row.sender_id != actor.pk:
+            changes['previous_sender_id'] = row.sender_id
+        Notification.objects.filter(pk=row.pk).update(**changes)
+    Notification.unread_changed(recipient.pk)
+    publish(recipient.pk, row.pk)
+
+
+def retract(recipient, actor, notification_type, post=None):
+    """Undo ``actor``'s part in the recipient's notifications, e.g. on
+    unlike or unfollow. Unread rows drop the actor and rows that only held
+    that actor are deleted, read or not, so like/unlike and
+    follow/unfollow churn leaves nothing behind."""
+    post_id = post.pk if post else None
+    if notification_type == 'comment' and Comment.objects.filter(post_id=post_id, author_id=actor.pk).exists():
+        # Still commenting on the post
+        return
+    with transaction.atomic():
+        rows = (
+            Notification.objects.select_for_update(of=('self',))
+            .filter(recipient_id=recipient.pk, notification_type=notification_type, post_id=post_id, actors=actor)
+            .filter(Q(is_read=False) | Q(actor_count__lte=1))
+        )
+        changed = []
+        for row in rows:
+            changed.append(row.pk)
+            remaining = Notification.actors.through.objects.filter(notification_id=row.pk)
+            remaining.filter(user_id=actor.pk).delete()
+            # Rows from before actors were recorded may count more actors
+            # than they hold, so also go when none are left
+            if row.actor_count <= 1 or not remaining.exists():
+                row.delete()
+                continue
+            changes = {'actor_count': F('actor_count') - 1}
+            if actor.pk in (row.sender_id, row.previous_sender_id):
+                # Show the actors who joined the row most recently
+                latest = list(remaining.order_by('-id').values_list('user_id', flat=True)[:2])
+                changes['sender_id'] = latest[0]
+                changes['previous_sender_id'] = latest[1] if len(latest) > 1 else None
+            Notification.objects.filter(pk=row.pk).update(**changes)
+    if changed:
+        Notification.unread_changed(recipient.pk)
+        publish(recipient.pk, *changed)
+
+
+def befriend(user_a, user_b):
+    """Friend notifications for both sides in one upsert"""
+    Notification.objects.bulk_create(
+        [
+            Notification(recipient=user_a, sender=user_b, notification_type='friend'),
+            Notification(recipient=user_b, sender=user_a, notification_type='friend'),
+        ],
+        ignore_conflicts=True,
+    )
+    Notification.unread_changed(user_a.pk)
+    Notification.unread_changed(user_b.pk)
+    # ignore_conflicts leaves the pks unset, so look the pair's rows up
+    rows = Notification.objects.filter(
+        Q(recipient=user_a, sender=user_b) | Q(recipient=user_b, sender=user_a),
+        notification_type='friend',
+    ).values_list('recipient_id', 'pk')
+    for recipient_id, pk in rows:
+        publish(recipient_id, pk)
+
+
+def unfollow(follower, followed):
+    """Clear notifications made stale by ``follower`` unfollowing ``followed``"""
+    retract(followed, follower, 'follow')
+    friend_rows = Notification.objects.filter(
+        Q(recipient=followed, sender=follower) | Q(recipient=follower, sender=followed),
+        notification_type='friend',
+    )
+    removed = list(friend_rows.values_list('recipient_id', 'pk'))
+    if removed:
+        friend_rows.delete()
+        Notification.unread_changed(follower.pk)
+        Notification.unread_changed(followed.pk)
+        for recipient_id, pk in removed:
+            publish(recipient_id, pk)
+
+
+def publish(recipient_id, *notification_ids):
+    """Push the given rows to the recipient's notification sockets once the
+    current transaction commits: the rendered inbox card for rows that
+    exist, a removal for rows that were deleted"""
+    transaction.on_commit(lambda: _send(recipient_id, notification_ids))
+
+
+def _send(recipient_id, notification_ids):
+    rows = {
+        row.pk: row for row in Notification.objects.select_related(
+            'sender', 'sender__profile', 'previous_sender', 'post', 'comment',
+        ).filter(recipient_id=recipient_id, pk__in=notification_ids)
+    }
+    group_send = async_to_sync(get_channel_layer().group_send)
+    for pk in notification_ids:
+        row = rows.get(pk)
+        if row is None:
+            event = {'type': 'notification_removed', 'id': pk}
+        else:
+            event = {
+                'type': 'notification_event',
+                'id': pk,
+                'notification_type': row.notification_type,
+                'message': row.get_message(),
+                'html': render_to_string('posts/_notifications.html', {'notifications': [row]}),
+            }
+        group_send(f'user_{recipient_id}_notifications', event)
+
+
+def mark_read_later(user_id, notification_ids):
+    """Mark one displayed inbox page as read off the request path"""
+    notification_ids = list(notification_ids)
+    if notification_ids:
+        transaction.on_commit(lambda: _read_marker.submit(mark_read, user_id, notification_ids))
+
+
+def mark_read(user_id, notification_ids):
+    try:
+        if Notification.objects.filter(
+            recipient_id=user_id, pk__in=notification_ids, is_read=False,
+        ).update(is_read=True):
+            Notification.unread_changed(user_id)
+    finally:
+        # Runs in a worker thread that Django doesn't clean up after
+        connection.close()
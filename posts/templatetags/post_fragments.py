@@ -0,0 +1,32 @@
+from django import template
+from posts import fragments
+
+register = template.Library()
+
+
+class PostFragmentNode(template.Node):
+    def __init__(self, nodelist, post, name):
+        self.nodelist = nodelist
+        self.post = post
+        self.name = name
+
+    def render(self, context):
+        post = self.post.resolve(context)
+        name = self.name.resolve(context)
+        return fragments.get_or_render(post, name, lambda: self.nodelist.render(context))
+
+
+@register.tag
+def postfragment(parser, token):
+    """Cache the enclosed, viewer-independent part of a post card.
+
+    Usage::
+
+        {% postfragment post "content" %} ... {% endpostfragment %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a post and a fragment name")
+    nodelist = parser.parse(('endpostfragment',))
+    parser.delete_first_token()
+    return PostFragmentNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]))
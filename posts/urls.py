@@ -4,6 +4,9 @@ from . import views
 urlpatterns = [
     path('feed/', views.feed_view, name='feed'),
     path('create/', views.create_post_view, name='create_post'),
+    path('uploads/', views.upload_start_view, name='upload_start'),
+    path('uploads/<uuid:upload_id>/', views.upload_chunk_view, name='upload_chunk'),
+    path('uploads/<uuid:upload_id>/finish/', views.upload_finish_view, name='upload_finish'),
     path('post/<int:pk>/', views.post_detail_view, name='post_detail'),
     path('post/<int:pk>/like/', views.like_post_view, name='like_post'),
     path('post/<int:pk>/delete/', views.delete_post_view, name='delete_post'),
@@ -11,5 +14,6 @@ urlpatterns = [
     path('comment/<int:pk>/delete/', views.delete_comment_view, name='delete_comment'),
     path('notifications/', views.notifications_view, name='notifications'),
     path('notifications/<int:pk>/read/', views.mark_notification_read, name='mark_notification_read'),
+    path('search/', views.search_view, name='search'),
     path('notifications/unread-count/', views.get_unread_count, name='unread_count'),
 ]
\ No newline at end of file
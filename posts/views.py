@@ -2,18 +2,44 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
-from django.views.decorators.http import require_POST
+from django.db import transaction
+from django.db.models import F
+from django.core.exceptions import ValidationError
+from django.views.decorators.http import require_POST, require_http_methods
 from django.contrib.auth.models import User
-from .models import Post, PostMedia, Comment, Notification
+from django.conf import settings
+from .models import Post, PostMedia, Comment, Notification, TimelineEntry, MediaUpload, UploadError
 from .forms import PostCreateForm, CommentForm
+from core import search
+from core.views import render_page
+from . import fragments, media_pipeline, notifications
+
+POSTS_PAGE_SIZE = 20
+NOTIFICATIONS_PAGE_SIZE = 20
+SEARCH_PAGE_SIZE = 20
+# Ranked results are paged by offset; deeper pages aren't served
+SEARCH_MAX_OFFSET = 500
+# ?type= filter -> indexed kinds
+SEARCH_TYPES = {'posts': 'post', 'comments': 'comment', 'users': 'user'}
+# Cached pieces of each card in posts/_feed_posts.html
+FEED_FRAGMENTS = ('content',)
+
+def render_posts_page(request, template, cards_template, posts, has_more, context=None):
+    """Render a keyset page of posts. AJAX requests (infinite scroll) get
+    just the rendered cards and the cursor for the next page."""
+    next_cursor = posts[-1].cursor if posts and has_more else None
+    return render_page(request, template, cards_template, {'posts': posts}, has_more, next_cursor, context)
 
 @login_required
 def feed_view(request):
-    posts = Post.objects.all().select_related('author', 'author__profile').prefetch_related('media', 'likes', 'comments')
-    context = {
-        'posts': posts,
-    }
-    return render(request, 'posts/feed.html', context)
+    before = request.GET.get('before')
+    # Range read of post ids from the home timeline, then one batched hydrate.
+    # Card fragments come from the cache; media is only loaded for misses.
+    post_ids, has_more = TimelineEntry.post_ids_for(request.user, POSTS_PAGE_SIZE, before=before)
+    posts = Post.objects.select_related('author', 'author__profile').in_bulk(post_ids)
+    posts = Post.mark_liked_by([posts[pk] for pk in post_ids if pk in posts], request.user)
+    fragments.load(posts, FEED_FRAGMENTS)
+    return render_posts_page(request, 'posts/feed.html', 'posts/_feed_posts.html', posts, has_more)
 
 @login_required
 def create_post_view(request):
@@ -26,22 +52,32 @@ def create_post_view(request):
             post.author = request.user
             post.save()
             
-            # Handle multiple file uploads
+            # Handle multiple file uploads. Resizing and metadata stripping
+            # happen in the media pipeline once the request has committed.
+            media_ids = []
             for file in files:
-                # Determine media type based on file extension
-                file_extension = file.name.split('.')[-1].lower()
-                if file_extension in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
-                    media_type = 'image'
-                elif file_extension in ['mp4', 'avi', 'mov', 'wmv', 'webm']:
-                    media_type = 'video'
-                else:
+                media_type = PostMedia.detect_media_type(file.name, file.content_type)
+                if media_type is None:
                     continue
                 
-                PostMedia.objects.create(
+                media = PostMedia.objects.create(
                     post=post,
                     file=file,
                     media_type=media_type
                 )
+                media_ids.append(media.pk)
+            # Files sent ahead through the chunked upload API
+            try:
+                uploads = list(MediaUpload.objects.filter(
+                    user=request.user, completed=True, pk__in=request.POST.getlist('uploads')
+                ))
+            except ValidationError:
+                uploads = []
+            for upload in uploads:
+                media_ids.append(upload.attach_to(post).pk)
+            media_pipeline.enqueue(media_ids)
+            
+            TimelineEntry.fan_out(post)
             
             messages.success(request, 'Post created successfully!')
             return redirect('feed')
@@ -65,16 +101,10 @@ def post_detail_view(request, pk):
             comment.post = post
             comment.author = request.user
             comment.save()
+            Post.objects.filter(pk=post.pk).update(comment_count=F('comment_count') + 1)
 
             # Create notification for post author
-            if post.author != request.user:
-                Notification.objects.create(
-                    recipient=post.author,
-                    sender=request.user,
-                    notification_type='comment',
-                    post=post,
-                    comment=comment
-                )
+            notifications.notify(post.author, request.user, 'comment', post=post, comment=comment)
 
             # Get avatar URL
             avatar_url = request.user.profile.avatar.url if request.user.profile.avatar else 'https://via.placeholder.com/40'
@@ -97,22 +127,17 @@ def post_detail_view(request, pk):
                 comment.post = post
                 comment.author = request.user
                 comment.save()
+                Post.objects.filter(pk=post.pk).update(comment_count=F('comment_count') + 1)
 
                 # Create notification
-                if post.author != request.user:
-                    Notification.objects.create(
-                        recipient=post.author,
-                        sender=request.user,
-                        notification_type='comment',
-                        post=post,
-                        comment=comment
-                    )
+                notifications.notify(post.author, request.user, 'comment', post=post, comment=comment)
 
                 messages.success(request, 'Comment added!')
                 return redirect('post_detail', pk=pk)
     else:
         comment_form = CommentForm()
 
+    post.viewer_liked = post.is_liked_by(request.user)
     context = {
         'post': post,
         'comments': comments,
@@ -123,42 +148,37 @@ def post_detail_view(request, pk):
 @login_required
 def user_posts_view(request, username):
     user = get_object_or_404(User, username=username)
-    posts = Post.objects.filter(author=user).select_related('author', 'author__profile').prefetch_related('media', 'likes', 'comments')
+    posts, has_more = Post.page_for_author(user, before=request.GET.get('before'), limit=POSTS_PAGE_SIZE)
+    Post.mark_liked_by(posts, request.user)
     
     context = {
         'profile_user': user,
-        'posts': posts,
     }
-    return render(request, 'posts/user_posts.html', context)
+    return render_posts_page(request, 'posts/user_posts.html', 'posts/_user_posts.html', posts, has_more, context)
 
 @login_required
 @require_POST
 def like_post_view(request, pk):
     post = get_object_or_404(Post, pk=pk)
     
-    if request.user in post.likes.all():
-        post.likes.remove(request.user)
+    Like = Post.likes.through
+    if post.is_liked_by(request.user):
+        # Only count the rows we actually removed or added, so double
+        # clicks can't skew the counter
+        if Like.objects.filter(post=post, user=request.user).delete()[0]:
+            Post.objects.filter(pk=post.pk).update(like_count=F('like_count') - 1)
         liked = False
-        # Delete like notification
-        Notification.objects.filter(
-            recipient=post.author,
-            sender=request.user,
-            notification_type='like',
-            post=post
-        ).delete()
+        # Take this like back out of the author's notification
+        notifications.retract(post.author, request.user, 'like', post=post)
     else:
-        post.likes.add(request.user)
+        if Like.objects.get_or_create(post=post, user=request.user)[1]:
+            Post.objects.filter(pk=post.pk).update(like_count=F('like_count') + 1)
         liked = True
-        # Create like notification
-        if post.author != request.user:
-            Notification.objects.create(
-                recipient=post.author,
-                sender=request.user,
-                notification_type='like',
-                post=post
-            )
+        # Create or roll up the like notification
+        notifications.notify(post.author, request.user, 'like', post=post)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        post.refresh_from_db(fields=['like_count'])
         return JsonResponse({
             'liked': liked,
             'total_likes': post.total_likes
@@ -184,12 +204,14 @@ def delete_comment_view(request, pk):
     post_pk = comment.post.pk
 
     if comment.author == request.user or comment.post.author == request.user:
+        # A concurrent delete of the same comment must not count it twice
+        if comment.delete()[1].get(Comment._meta.label):
+            Post.objects.filter(pk=post_pk).update(comment_count=F('comment_count') - 1)
+            notifications.retract(comment.post.author, comment.author, 'comment', post=comment.post)
         # Check if it's an AJAX request
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            comment.delete()
             return JsonResponse({'success': True})
         else:
-            comment.delete()
             messages.success(request, 'Comment deleted successfully!')
     elif request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({'success': False, 'error': 'Permission denied'})
@@ -200,15 +222,15 @@ def delete_comment_view(request, pk):
 
 @login_required
 def notifications_view(request):
-    notifications = Notification.objects.filter(recipient=request.user).select_related('sender', 'sender__profile', 'post')
+    page, has_more = Notification.inbox(request.user, before=request.GET.get('before'), limit=NOTIFICATIONS_PAGE_SIZE)
+    # Only the page being shown is marked read, after the response is built
+    notifications.mark_read_later(request.user.id, [n.pk for n in page if not n.is_read])
     
-    # Mark all as read
-    notifications.filter(is_read=False).update(is_read=True)
-    
-    context = {
-        'notifications': notifications,
-    }
-    return render(request, 'posts/notifications.html', context)
+    next_cursor = page[-1].cursor if page and has_more else None
+    return render_page(
+        request, 'posts/notifications.html', 'posts/_notifications.html',
+        {'notifications': page}, has_more, next_cursor,
+    )
 
 @login_required
 def mark_notification_read(request, pk):
@@ -219,5 +241,106 @@ def mark_notification_read(request, pk):
 
 @login_required
 def get_unread_count(request):
-    count = Notification.objects.filter(recipient=request.user, is_read=False).count()
-    return JsonResponse({'count': count})
+    return JsonResponse({'count': Notification.unread_count(request.user.id)})
+
+def hydrate_hits(hits):
+    """Load the objects behind a page of search hits, one query per kind,
+    keeping rank order and dropping hits whose object is gone"""
+    querysets = {
+        'post': Post.objects.select_related('author', 'author__profile'),
+        'comment': Comment.objects.select_related('author', 'author__profile', 'post'),
+        'user': User.objects.select_related('profile'),
+    }
+    objects = {
+        kind: querysets[kind].in_bulk([hit.object_id for hit in hits if hit.kind == kind])
+        for kind in {hit.kind for hit in hits}
+    }
+    return [
+        {'kind': hit.kind, 'object': objects[hit.kind][hit.object_id], 'snippet': search.highlight(hit.snippet)}
+        for hit in hits if hit.object_id in objects[hit.kind]
+    ]
+
+@login_required
+def search_view(request):
+    query = request.GET.get('q', '').strip()
+    search_type = request.GET.get('type', '')
+    kinds = [SEARCH_TYPES[search_type]] if search_type in SEARCH_TYPES else list(SEARCH_TYPES.values())
+    # The cursor is the offset of the next page
+    try:
+        offset = min(max(int(request.GET.get('before') or 0), 0), SEARCH_MAX_OFFSET)
+    except ValueError:
+        offset = 0
+    hits = search.search(query, kinds, offset=offset, limit=SEARCH_PAGE_SIZE + 1)
+    has_more = len(hits) > SEARCH_PAGE_SIZE and offset + SEARCH_PAGE_SIZE < SEARCH_MAX_OFFSET
+    results = hydrate_hits(hits[:SEARCH_PAGE_SIZE])
+    next_cursor = str(offset + SEARCH_PAGE_SIZE) if has_more else None
+    context = {
+        'query': query,
+        'search_type': search_type if search_type in SEARCH_TYPES else '',
+    }
+    return render_page(
+        request, 'posts/search.html', 'posts/_search_results.html',
+        {'results': results}, has_more, next_cursor, context,
+    )
+
+def upload_error(error):
+    return JsonResponse({'success': False, 'error': str(error)}, status=error.status)
+
+@login_required
+@require_POST
+def upload_start_view(request):
+    """Begin a resumable upload: POST filename, size and content_type"""
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid size'}, status=400)
+    try:
+        upload = MediaUpload.start(
+            request.user, request.POST.get('filename'), size, request.POST.get('content_type', '')
+        )
+    except UploadError as error:
+        return upload_error(error)
+    return JsonResponse({
+        'success': True,
+        'upload_id': str(upload.pk),
+        'offset': 0,
+        'chunk_size': settings.MEDIA_UPLOAD_CHUNK_SIZE,
+    })
+
+@login_required
+@require_http_methods(['GET', 'POST'])
+def upload_chunk_view(request, upload_id):
+    """GET reports how much has been received, so a client can resume.
+    POST appends the raw request body at the Upload-Offset header, with an
+    optional Upload-Checksum (SHA-256 of the chunk)."""
+    if request.method == 'GET':
+        upload = get_object_or_404(MediaUpload, pk=upload_id, user=request.user)
+        return JsonResponse({'success': True, 'offset': upload.received, 'size': upload.size})
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+        length = int(request.headers.get('Content-Length') or 0)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid offset'}, status=400)
+    # Reject oversized chunks from the headers before reading the body
+    if length > settings.MEDIA_UPLOAD_CHUNK_SIZE:
+        return JsonResponse({'success': False, 'error': 'Invalid chunk size'}, status=413)
+
+    with transaction.atomic():
+        upload = get_object_or_404(MediaUpload.objects.select_for_update(), pk=upload_id, user=request.user)
+        try:
+            upload.append(request, offset, length, request.headers.get('Upload-Checksum'))
+        except UploadError as error:
+            return upload_error(error)
+    return JsonResponse({'success': True, 'offset': upload.received})
+
+@login_required
+@require_POST
+def upload_finish_view(request, upload_id):
+    """Verify the assembled file against the client's SHA-256"""
+    upload = get_object_or_404(MediaUpload, pk=upload_id, user=request.user)
+    try:
+        upload.finalize(request.POST.get('sha256'))
+    except UploadError as error:
+        return upload_error(error)
+    return JsonResponse({'success': True, 'upload_id': str(upload.pk), 'sha256': upload.sha256})
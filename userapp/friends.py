@@ -0,0 +1,56 @@
+import time
+from collections import OrderedDict
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from .models import Friendship
+
+# Friend id sets are held in a small per-process LRU in front of the shared
+# default cache (Redis whenever several workers run, see CACHES in
+# settings). Local entries expire quickly so other workers' changes show up
+# within LOCAL_CACHE_TTL seconds; the shared entry is deleted on change.
+LOCAL_CACHE_SIZE = 2048
+LOCAL_CACHE_TTL = 5
+SHARED_CACHE_TTL = 3600
+
+_local = OrderedDict()
+
+
+def _cache_key(user_id):
+    return f'friend_ids_{user_id}'
+
+
+def friend_ids(user_id):
+    """Return the frozenset of user ids that are friends with user_id"""
+    now = time.monotonic()
+    entry = _local.get(user_id)
+    if entry and entry[0] > now:
+        _local.move_to_end(user_id)
+        return entry[1]
+
+    ids = cache.get(_cache_key(user_id))
+    if ids is None:
+        ids = list(Friendship.objects.filter(user_id=user_id).values_list('friend_id', flat=True))
+        cache.set(_cache_key(user_id), ids, SHARED_CACHE_TTL)
+    ids = frozenset(ids)
+
+    _local[user_id] = (now + LOCAL_CACHE_TTL, ids)
+    _local.move_to_end(user_id)
+    while len(_local) > LOCAL_CACHE_SIZE:
+        _local.popitem(last=False)
+    return ids
+
+
+def are_friends(user_a, user_b):
+    """True if the two users follow each other"""
+    return user_b.id in friend_ids(user_a.id)
+
+
+def friends_of(user):
+    """Queryset of the user's friends"""
+    return User.objects.filter(id__in=friend_ids(user.id))
+
+
+def invalidate(*user_ids):
+    for user_id in user_ids:
+        _local.pop(user_id, None)
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Keyset indexes for follower/following lists, newest follow first. The
+    follow table is Django's auto-created M2M table, so they're added in SQL."""
+
+    dependencies = [
+        ('userapp', '0002_friendship'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX userapp_followers_list_idx ON userapp_userprofile_followers (userprofile_id, id)',
+            'DROP INDEX userapp_followers_list_idx',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX userapp_following_list_idx ON userapp_userprofile_followers (user_id, id)',
+            'DROP INDEX userapp_following_list_idx',
+        ),
+    ]
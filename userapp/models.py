@@ -1,7 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, post_save, post_delete, m2m_changed
 from django.dispatch import receiver
+from core import search
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
@@ -29,6 +31,97 @@ class UserProfile(models.Model):
     def is_following(self, user):
         return self.followers.filter(id=user.id).exists()
 
+    @staticmethod
+    def follow_page(user, viewer, followers=True, before=None, limit=30):
+        """A page of ``user``'s followers (or, with ``followers=False``, the
+        accounts they follow), most recent follow first.
+
+        Returns the users, whether more remain, and the cursor for the next
+        page (the id of the last follow row). Profiles come back in the same
+        query, with ``viewer_follows`` and ``follows_viewer`` flags for
+        ``viewer`` set on each user.
+        """
+        Follow = UserProfile.followers.through
+        if followers:
+            rows = Follow.objects.filter(userprofile__user=user).select_related('user__profile')
+            listed_user, listed_profile = 'user_id', 'user__profile__id'
+        else:
+            rows = Follow.objects.filter(user=user).select_related('userprofile__user')
+            listed_user, listed_profile = 'userprofile__user_id', 'userprofile_id'
+        try:
+            rows = rows.filter(id__lt=int(before)) if before else rows
+        except ValueError:
+            pass
+        rows = list(
+            rows.annotate(
+                viewer_follows=Exists(Follow.objects.filter(userprofile_id=OuterRef(listed_profile), user_id=viewer.id)),
+                follows_viewer=Exists(Follow.objects.filter(userprofile__user_id=viewer.id, user_id=OuterRef(listed_user))),
+            ).order_by('-id')[:limit + 1]
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        people = []
+        for row in rows:
+            if followers:
+                person = row.user
+            else:
+                person = row.userprofile.user
+                person.profile = row.userprofile
+            person.viewer_follows = row.viewer_follows
+            person.follows_viewer = row.follows_viewer
+            people.append(person)
+        next_cursor = str(rows[-1].id) if rows and has_more else None
+        return people, has_more, next_cursor
+
+    def search_text(self):
+        """What the user is found by in search"""
+        return f"{self.user.username} {self.user.get_full_name()} {self.bio}"
+
+class Friendship(models.Model):
+    """Materialized mutual follow, stored in both directions.
+
+    Kept in sync with ``UserProfile.followers`` by the m2m_changed receiver
+    below, so "are these two friends" is a single indexed lookup. Use
+    ``userapp.friends`` for cached reads.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='friendships')
+    friend = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'friend')
+
+    def __str__(self):
+        return f"{self.user.username} & {self.friend.username}"
+
+    @staticmethod
+    def sync(user_a_id, user_b_id):
+        """Create or remove the friendship rows for a pair to match their
+        current follows. Returns True if they are friends."""
+        follows = UserProfile.followers.through.objects
+        mutual = (
+            follows.filter(userprofile__user_id=user_a_id, user_id=user_b_id).exists() and
+            follows.filter(userprofile__user_id=user_b_id, user_id=user_a_id).exists()
+        )
+        if mutual:
+            Friendship.objects.bulk_create([
+                Friendship(user_id=user_a_id, friend_id=user_b_id),
+                Friendship(user_id=user_b_id, friend_id=user_a_id),
+            ], ignore_conflicts=True)
+        elif Friendship.objects.filter(
+            models.Q(user_id=user_a_id, friend_id=user_b_id) |
+            models.Q(user_id=user_b_id, friend_id=user_a_id)
+        ).delete()[0]:
+            # However the follow was removed (views, admin, shell), close
+            # their chat once the change is visible to other workers
+            from chat.models import ChatRoom
+            transaction.on_commit(lambda: ChatRoom.invalidate_context(user_a_id, user_b_id))
+
+        # After commit, so other workers can't re-cache the old rows
+        from .friends import invalidate
+        transaction.on_commit(lambda: invalidate(user_a_id, user_b_id))
+        return mutual
+
 # Signal to create UserProfile automatically when User is created
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -38,3 +131,62 @@ def create_user_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
     instance.profile.save()
+
+# Release replaced or deleted avatars from content-addressed storage. The
+# shared default avatar is never released.
+def _release_avatar(storage, name):
+    if name and name != UserProfile._meta.get_field('avatar').default:
+        transaction.on_commit(lambda: storage.delete(name))
+
+@receiver(post_init, sender=UserProfile)
+def remember_avatar(sender, instance, **kwargs):
+    # Read the raw value so a deferred avatar isn't fetched
+    value = instance.__dict__.get('avatar')
+    instance._stored_avatar = getattr(value, 'name', value)
+
+@receiver(post_save, sender=UserProfile)
+def release_replaced_avatar(sender, instance, **kwargs):
+    if 'avatar' not in instance.__dict__:
+        return
+    if instance.avatar.name != instance._stored_avatar:
+        _release_avatar(instance.avatar.storage, instance._stored_avatar)
+        instance._stored_avatar = instance.avatar.name
+
+@receiver(post_delete, sender=UserProfile)
+def release_deleted_avatar(sender, instance, **kwargs):
+    _release_avatar(instance.avatar.storage, instance.avatar.name)
+
+# Users are indexed through their profile, which is saved with every User save
+@receiver(post_save, sender=UserProfile)
+def index_user(sender, instance, **kwargs):
+    search.index('user', instance.user_id, instance.search_text())
+
+@receiver(post_delete, sender=UserProfile)
+def unindex_user(sender, instance, **kwargs):
+    search.unindex('user', instance.user_id)
+
+# Keep Friendship in sync with follows, whichever side of the M2M changed
+def _follow_pairs(instance, reverse, model, pk_set):
+    """(followed user id, follower user id) pairs touched by an m2m change"""
+    if not reverse:
+        return [(instance.user_id, follower_id) for follower_id in pk_set]
+    followed_ids = model.objects.filter(pk__in=pk_set).values_list('user_id', flat=True)
+    return [(followed_id, instance.pk) for followed_id in followed_ids]
+
+@receiver(m2m_changed, sender=UserProfile.followers.through)
+def sync_friendships(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action == 'pre_clear':
+        pk_set = (
+            instance.followers.values_list('id', flat=True) if not reverse
+            else instance.following.values_list('id', flat=True)
+        )
+        instance._cleared_follow_pairs = _follow_pairs(instance, reverse, model, pk_set)
+        return
+    if action == 'post_clear':
+        pairs = getattr(instance, '_cleared_follow_pairs', [])
+    elif action in ('post_add', 'post_remove'):
+        pairs = _follow_pairs(instance, reverse, model, pk_set)
+    else:
+        return
+    for followed_id, follower_id in pairs:
+        Friendship.sync(followed_id, follower_id)
@@ -6,7 +6,11 @@ from django.contrib import messages
 from django.contrib.auth.models import User
 from .forms import SignUpForm, UserUpdateForm, ProfileUpdateForm
 from .models import UserProfile
-from posts.models import Notification
+from .friends import are_friends
+from posts import notifications
+from core.views import render_page
+
+FOLLOW_PAGE_SIZE = 30
 
 def signup_view(request):
     if request.method == 'POST':
@@ -117,61 +121,43 @@ def follow_user(request, username):
         profile = user_to_follow.profile
         if profile.is_following(request.user):
             # Unfollow
+            # Friendship.sync closes any open chat between them
             profile.followers.remove(request.user)
             messages.success(request, f'You unfollowed {username}.')
-            # Delete follow notification
-            Notification.objects.filter(
-                recipient=user_to_follow,
-                sender=request.user,
-                notification_type='follow'
-            ).delete()
-            # Delete friend notification if exists
-            Notification.objects.filter(
-                recipient=request.user,
-                sender=user_to_follow,
-                notification_type='friend'
-            ).delete()
-            Notification.objects.filter(
-                recipient=user_to_follow,
-                sender=request.user,
-                notification_type='friend'
-            ).delete()
+            # Drop the follow from their notification and any friend notifications
+            notifications.unfollow(request.user, user_to_follow)
         else:
             # Follow
             profile.followers.add(request.user)
             messages.success(request, f'You are now following {username}.')
             
-            # Create follow notification
-            Notification.objects.create(
-                recipient=user_to_follow,
-                sender=request.user,
-                notification_type='follow'
-            )
+            # Create or roll up the follow notification
+            notifications.notify(user_to_follow, request.user, 'follow')
             
             # Check if they're now friends (both following each other)
-            if request.user.profile.is_following(user_to_follow):
+            if are_friends(request.user, user_to_follow):
                 # Create friend notifications for both users
-                Notification.objects.get_or_create(
-                    recipient=request.user,
-                    sender=user_to_follow,
-                    notification_type='friend'
-                )
-                Notification.objects.get_or_create(
-                    recipient=user_to_follow,
-                    sender=request.user,
-                    notification_type='friend'
-                )
+                notifications.befriend(request.user, user_to_follow)
     
     return redirect('profile', username=username)
 
+def render_follow_page(request, template, user, followers):
+    """Render a keyset page of a follower/following list. AJAX requests
+    (infinite scroll) get just the rendered rows and the next cursor."""
+    people, has_more, next_cursor = UserProfile.follow_page(
+        user, request.user, followers=followers, before=request.GET.get('before'), limit=FOLLOW_PAGE_SIZE,
+    )
+    return render_page(
+        request, template, 'userapp/_follow_list.html',
+        {'people': people}, has_more, next_cursor, {'profile_user': user},
+    )
+
 @login_required
 def followers_list(request, username):
     user = get_object_or_404(User, username=username)
-    followers = user.profile.followers.all()
-    return render(request, 'userapp/followers_list.html', {'profile_user': user, 'followers': followers})
+    return render_follow_page(request, 'userapp/followers_list.html', user, followers=True)
 
 @login_required
 def following_list(request, username):
     user = get_object_or_404(User, username=username)
-    following = User.objects.filter(profile__followers=user)
-    return render(request, 'userapp/following_list.html', {'profile_user': user, 'following': following})
+    return render_follow_page(request, 'userapp/following_list.html', user, followers=False)